@@ -1,18 +1,17 @@
 import collections
-from copy import deepcopy
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from itertools import chain
-from numpy.linalg import inv
-from numba import njit
 
 import numpy
-from bnsl.accessory import g_test, cor_test
-from rpy2.robjects import pandas2ri
-from rpy2.robjects.packages import importr
+from scipy.linalg import cho_factor, cho_solve, cholesky, lapack
 from skopt import gp_minimize, Space
 from skopt.space import Real
 
-pandas2ri.activate()
-base, bnlearn, stats = importr('base'), importr('bnlearn'), importr('stats')
+from ci_cache import MemoryCache, ci_key, column_digests
+from ci_tests import GaussianCITest, GTest
 
 
 def chunks(lst, n):
@@ -22,33 +21,434 @@ def chunks(lst, n):
         yield lst[i:i + size]
 
 
-@njit(fastmath=True)
+def sq_dist(X, Y=None):
+    """
+    @param X: data matrix of shape (n, p)
+    @param Y: data matrix of shape (m, p), X is used if None
+    @return: matrix of pairwise squared Euclidean distances of shape (n, m)
+    """
+    X = numpy.asarray(X, dtype=float)
+    x_norm = numpy.einsum('ij,ij->i', X, X)
+    if Y is None:
+        Y, y_norm = X, x_norm
+    else:
+        Y = numpy.asarray(Y, dtype=float)
+        y_norm = numpy.einsum('ij,ij->i', Y, Y)
+    D = x_norm[:, None] + y_norm[None, :] - 2 * X @ Y.T
+    # the expansion can go slightly negative due to cancellation
+    return numpy.maximum(D, 0, out=D)
+
+
+def rbf_kernel(D, sigma):
+    """
+    @param D: matrix of pairwise squared distances
+    @param sigma: kernel variance of RBF kernel
+    @return: RBF kernel matrix
+    """
+    return numpy.exp(-D / sigma ** 2 / 2)
+
+
+def krr_solve(K, y, lamda):
+    """
+    @param K: kernel matrix of the training data
+    @param y: target values of the training data
+    @param lamda: penalty parameter used for KRR
+    @return: dual coefficients of KRR
+    """
+    K = numpy.array(K, dtype=float)
+    K[numpy.diag_indices_from(K)] += lamda
+    return cho_solve(cho_factor(K, lower=True, overwrite_a=True, check_finite=False), y, check_finite=False)
+
+
 def krr_numpy(X_train, y_train, X_test, lamda, sigma):
-    X = numpy.concatenate((X_train, X_test)).transpose()
-    X_amend = numpy.zeros((X.shape[0], X.shape[1], X.shape[1]))
-    for i in range(X.shape[0]):
-        for j in range(X.shape[1]):
-            for k in range(X.shape[1]):
-                X_amend[i, j, k] = X[i, j]
-    K = X_amend - numpy.transpose(X_amend, (0, 2, 1))
-    K = numpy.power(K, 2).sum(axis=0)
-    K = numpy.exp(-K / sigma ** 2 / 2)
-    y_pred = numpy.zeros(X_test.shape[0])
-    M = inv(K[: X_train.shape[0], :][:, : X_train.shape[0]] + lamda * numpy.identity(X_train.shape[0]))
-    KM = numpy.zeros((X_test.shape[0], X_train.shape[0]))
-    for i in range(X_test.shape[0]):
-        for j in range(X_train.shape[0]):
-            for k in range(X_train.shape[0]):
-                KM[i, j] += K[i + X_train.shape[0], k] * M[k, j]
-    for i in range(X_test.shape[0]):
-        for j in range(X_train.shape[0]):
-            y_pred[i] += KM[i, j] * y_train[j]
-    return y_pred
+    K_train = rbf_kernel(sq_dist(X_train), sigma)
+    K_test = rbf_kernel(sq_dist(X_test, X_train), sigma)
+    return K_test @ krr_solve(K_train, numpy.asarray(y_train, dtype=float), lamda)
+
+
+class IncrementalKRR:
+    """
+    Exact KRR for training predictors that only change in a few rows between refits. The Cholesky factor of the kernel
+    of the last full fit is kept, and the kernel change caused by the modified rows is applied as a low-rank
+    correction through the Woodbury identity.
+    """
+
+    def __init__(self, lamda, sigma, update_rank=0.05):
+        """
+        @param lamda: penalty parameter used for KRR
+        @param sigma: kernel variance of RBF kernel
+        @param update_rank: largest fraction of modified training rows handled by a low-rank correction, more
+        modified rows trigger a full refit
+        """
+        self.lamda = lamda
+        self.sigma = sigma
+        self.update_rank = update_rank
+
+    def fit(self, X_train, y_train):
+        self.X_base = numpy.array(X_train, dtype=float)
+        self.X_train = self.X_base.copy()
+        self.y_train = numpy.asarray(y_train, dtype=float)
+        K = rbf_kernel(sq_dist(self.X_base), self.sigma)
+        K[numpy.diag_indices_from(K)] += self.lamda
+        self.factor = cho_factor(K, lower=True, overwrite_a=True, check_finite=False)
+        self.alpha_base = cho_solve(self.factor, self.y_train, check_finite=False)
+        self.alpha = self.alpha_base
+        return self
+
+    def update(self, X_train):
+        X_train = numpy.asarray(X_train, dtype=float)
+        if numpy.array_equal(X_train, self.X_train):
+            return self
+        # rows that differ from the factorized kernel
+        R = numpy.flatnonzero((X_train != self.X_base).any(axis=1))
+        if len(R) > self.update_rank * len(X_train):
+            return self.fit(X_train, self.y_train)
+        self.X_train = X_train.copy()
+        # the kernel change is supported on the rows and columns R: dK = E S^T + S E^T - S dK_RR S^T
+        E = rbf_kernel(sq_dist(X_train, X_train[R]), self.sigma) - rbf_kernel(sq_dist(self.X_base, self.X_base[R]),
+                                                                               self.sigma)
+        S = numpy.zeros_like(E)
+        S[R, numpy.arange(len(R))] = 1
+        U = numpy.hstack((E, S))
+        V = numpy.hstack((S, E - S @ E[R]))
+        A_inv_U = cho_solve(self.factor, U, check_finite=False)
+        capacitance = numpy.identity(U.shape[1]) + V.T @ A_inv_U
+        self.alpha = self.alpha_base - A_inv_U @ numpy.linalg.solve(capacitance, V.T @ self.alpha_base)
+        return self
+
+    def predict(self, X_test):
+        return rbf_kernel(sq_dist(X_test, self.X_train), self.sigma) @ self.alpha
+
+
+def kfold(n, k):
+    """
+    @param n: number of samples
+    @param k: number of sub-data_bn in cross validation
+    @return: list of (train indices, test indices) for each fold
+    """
+    idx_chunks = list(chunks(list(range(n)), k))
+    return [(numpy.array(list(chain.from_iterable([x for j, x in enumerate(idx_chunks) if j != i])), dtype=int),
+             numpy.array(idx_chunks[i], dtype=int)) for i in range(k)]
+
+
+def krr_cv_mse(D, y, folds, lamda, sigma):
+    """
+    @param D: cached matrix of pairwise squared distances between the training predictors
+    @param y: target values of the training data
+    @param folds: list of (train indices, test indices) for cross validation
+    @param lamda: penalty parameter used for KRR
+    @param sigma: kernel variance of RBF kernel
+    @return: cross validated mean square error of KRR
+    """
+    K = rbf_kernel(D, sigma)
+    mse = 0
+    for train_id, test_id in folds:
+        alpha = krr_solve(K[numpy.ix_(train_id, train_id)], y[train_id], lamda)
+        mse += numpy.square(y[test_id] - K[numpy.ix_(test_id, train_id)] @ alpha).mean() / len(folds)
+    return mse
+
+
+def krr_cv_path(D, y, folds, lamdas, sigma):
+    """
+    @param D: cached matrix of pairwise squared distances between the training predictors
+    @param y: target values of the training data
+    @param folds: list of (train indices, test indices) for cross validation
+    @param lamdas: array of penalty parameters used for KRR
+    @param sigma: kernel variance of RBF kernel
+    @return: cross validated mean square error of KRR for each lamda
+    """
+    K = rbf_kernel(D, sigma)
+    lamdas = numpy.asarray(lamdas, dtype=float)
+    mse = numpy.zeros(len(lamdas))
+    for train_id, test_id in folds:
+        # one eigendecomposition per fold serves every lamda
+        w, Q = numpy.linalg.eigh(K[numpy.ix_(train_id, train_id)])
+        Qy = Q.T @ y[train_id]
+        y_pred = (K[numpy.ix_(test_id, train_id)] @ Q) @ (Qy[:, None] / (w[:, None] + lamdas[None, :]))
+        mse += numpy.square(y[test_id][:, None] - y_pred).mean(axis=0) / len(folds)
+    return mse
+
+
+def krr_loo_mse(D, y, lamda, sigma, cv='loo'):
+    """
+    @param D: cached matrix of pairwise squared distances between the training predictors
+    @param y: target values of the training data
+    @param lamda: penalty parameter used for KRR
+    @param sigma: kernel variance of RBF kernel
+    @param cv: 'loo' for exact leave-one-out or 'gcv' for generalized cross validation
+    @return: leave-one-out (or generalized cross validated) mean square error of KRR
+    """
+    K = rbf_kernel(D, sigma)
+    K[numpy.diag_indices_from(K)] += lamda
+    L = cholesky(K, lower=True, overwrite_a=True, check_finite=False)
+    L_inv = lapack.dtrtri(L, lower=1, overwrite_c=1)[0]
+    alpha = L_inv.T @ (L_inv @ y)
+    # diagonal of (K + lamda I)^-1
+    G_diag = numpy.square(L_inv).sum(axis=0)
+    if cv == 'loo':
+        return numpy.square(alpha / G_diag).mean()
+    elif cv == 'gcv':
+        return numpy.square(alpha).mean() / numpy.square(G_diag.mean())
+    else:
+        raise Exception(cv + ' cross validation is undefined.')
+
+
+def krr_loo_path(D, y, lamdas, sigma, cv='loo'):
+    """
+    @param D: cached matrix of pairwise squared distances between the training predictors
+    @param y: target values of the training data
+    @param lamdas: array of penalty parameters used for KRR
+    @param sigma: kernel variance of RBF kernel
+    @param cv: 'loo' for exact leave-one-out or 'gcv' for generalized cross validation
+    @return: leave-one-out (or generalized cross validated) mean square error of KRR for each lamda
+    """
+    lamdas = numpy.asarray(lamdas, dtype=float)
+    w, Q = numpy.linalg.eigh(rbf_kernel(D, sigma))
+    # eigenvalues of the hat matrix K (K + lamda I)^-1
+    shrink = w[:, None] / (w[:, None] + lamdas[None, :])
+    residual = y[:, None] - Q @ (shrink * (Q.T @ y)[:, None])
+    if cv == 'loo':
+        # the leave-one-out residual is the training residual inflated by the leverage of each sample
+        return numpy.square(residual / (1 - numpy.square(Q) @ shrink)).mean(axis=0)
+    elif cv == 'gcv':
+        return numpy.square(residual).mean(axis=0) / numpy.square(1 - shrink.mean(axis=0))
+    else:
+        raise Exception(cv + ' cross validation is undefined.')
+
+
+def fit_rbf_features(X, sigma, approx='nystroem', n_components=100, random_state=None):
+    """
+    @param X: training predictors
+    @param sigma: kernel variance of RBF kernel
+    @param approx: 'nystroem' for Nystroem landmarks or 'rff' for random Fourier features
+    @param n_components: number of landmarks or random features
+    @param random_state: seed used to draw the landmarks or random features
+    @return: feature map whose inner products approximate the RBF kernel
+    """
+    X = numpy.asarray(X, dtype=float)
+    rng = numpy.random.RandomState(random_state)
+    if approx == 'nystroem':
+        basis = X[rng.choice(len(X), min(n_components, len(X)), replace=False)]
+        w, Q = numpy.linalg.eigh(rbf_kernel(sq_dist(basis), sigma))
+        # K_mm^(-1/2) restricted to the numerically non-null eigenspace
+        keep = w > w.max() * 1e-10
+        weights = Q[:, keep] / numpy.sqrt(w[keep])
+    elif approx == 'rff':
+        basis = rng.normal(scale=1 / sigma, size=(X.shape[1], n_components))
+        weights = rng.uniform(0, 2 * numpy.pi, n_components)
+    else:
+        raise Exception(approx + ' kernel approximation is undefined.')
+    return {'approx': approx, 'sigma': sigma, 'basis': basis, 'weights': weights}
+
+
+def rbf_features(X, feature_map):
+    """
+    @param X: data matrix
+    @param feature_map: feature map returned by fit_rbf_features
+    @return: approximate RBF features of X
+    """
+    X = numpy.asarray(X, dtype=float)
+    if feature_map['approx'] == 'nystroem':
+        return rbf_kernel(sq_dist(X, feature_map['basis']), feature_map['sigma']) @ feature_map['weights']
+    return numpy.sqrt(2 / len(feature_map['weights'])) * numpy.cos(X @ feature_map['basis'] + feature_map['weights'])
+
+
+def ridge_solve(Phi, y, lamda):
+    """
+    @param Phi: feature matrix of the training data
+    @param y: target values of the training data
+    @param lamda: penalty parameter used for KRR
+    @return: primal coefficients of the ridge regression on Phi
+    """
+    return krr_solve(Phi.T @ Phi, Phi.T @ y, lamda)
+
+
+def ridge_cv_mse(Phi, y, folds, lamda, cv='kfold'):
+    """
+    @param Phi: feature matrix of the training data
+    @param y: target values of the training data
+    @param folds: list of (train indices, test indices) for k-fold cross validation
+    @param lamda: penalty parameter used for KRR
+    @param cv: 'kfold', 'loo' or 'gcv'
+    @return: cross validated mean square error of the ridge regression on Phi
+    """
+    if cv == 'kfold':
+        mse = 0
+        for train_id, test_id in folds:
+            w = ridge_solve(Phi[train_id], y[train_id], lamda)
+            mse += numpy.square(y[test_id] - Phi[test_id] @ w).mean() / len(folds)
+        return mse
+    A = Phi.T @ Phi
+    A[numpy.diag_indices_from(A)] += lamda
+    B = cho_solve(cho_factor(A, lower=True, overwrite_a=True, check_finite=False), Phi.T, check_finite=False)
+    residual = y - Phi @ (B @ y)
+    # diagonal of the hat matrix Phi (Phi^T Phi + lamda I)^-1 Phi^T
+    h = numpy.einsum('ij,ji->i', Phi, B)
+    if cv == 'loo':
+        return numpy.square(residual / (1 - h)).mean()
+    elif cv == 'gcv':
+        return numpy.square(residual).mean() / numpy.square(1 - h.mean())
+    else:
+        raise Exception(cv + ' cross validation is undefined.')
+
+
+def krr_approx(X_train, y_train, X_test, lamda, sigma, approx='nystroem', n_components=100, random_state=None):
+    feature_map = fit_rbf_features(X_train, sigma, approx, n_components, random_state)
+    w = ridge_solve(rbf_features(X_train, feature_map), numpy.asarray(y_train, dtype=float), lamda)
+    return rbf_features(X_test, feature_map) @ w
+
+
+def krr(X_train, y_train, X_test, lamda, sigma, approx=None, n_components=100, random_state=None):
+    """
+    exact KRR if approx is None, otherwise KRR with an approximate RBF kernel (see fit_rbf_features)
+    """
+    if approx is None:
+        return krr_numpy(X_train, y_train, X_test, lamda, sigma)
+    return krr_approx(X_train, y_train, X_test, lamda, sigma, approx, n_components, random_state)
+
+
+def tune_krr(X_train, y_train, X_test, k=5, lamda=0.1, sigma=20, bo=True, sigma_low=1, sigma_high=30, lamda_low=0.01,
+             lamda_high=0.4, n_calls=20, n_initial_points=10, n_points=1000, n_lamdas=None, cv='kfold', approx=None,
+             n_components=100, random_state=None):
+    """
+    @param X_train: predictors of the training data
+    @param y_train: target values of the training data
+    @param X_test: predictors of the data to be imputed
+    @param random_state: seed of Bayesian Optimization and of the kernel approximation
+    @return: tuned sigma, tuned lamda and the KRR predictions for X_test
+    see krr_iterative_imputation for the other parameters
+    """
+    X_train = numpy.asarray(X_train, dtype=float)
+    y_train = numpy.asarray(y_train, dtype=float)
+    # the same landmarks (or random features) are used by every trial and by the final fit
+    feature_seed = numpy.random.RandomState(random_state).randint(numpy.iinfo(numpy.int32).max)
+    if bo:
+        folds = kfold(len(X_train), k)
+        if approx is None:
+            # the pairwise distances do not depend on the hyperparameters, so compute them once per variable
+            D = sq_dist(X_train)
+
+            def cv_mse(sigma, lamda):
+                if cv == 'kfold':
+                    return krr_cv_mse(D, y_train, folds, lamda, sigma)
+                return krr_loo_mse(D, y_train, lamda, sigma, cv)
+
+            def cv_path(sigma, lamdas):
+                if cv == 'kfold':
+                    return krr_cv_path(D, y_train, folds, lamdas, sigma)
+                return krr_loo_path(D, y_train, lamdas, sigma, cv)
+        else:
+            def cv_mse(sigma, lamda):
+                Phi = rbf_features(X_train, fit_rbf_features(X_train, sigma, approx, n_components, feature_seed))
+                return ridge_cv_mse(Phi, y_train, folds, lamda, cv)
+
+            def cv_path(sigma, lamdas):
+                Phi = rbf_features(X_train, fit_rbf_features(X_train, sigma, approx, n_components, feature_seed))
+                return numpy.array([ridge_cv_mse(Phi, y_train, folds, lamda, cv) for lamda in lamdas])
+
+        # find the optimal hyperparameters for KRR via Bayesian Optimization
+        if n_lamdas is None:
+            [sigma, lamda] = gp_minimize(lambda args: cv_mse(args[0], args[1]), Space(
+                [Real(name='sigma', low=sigma_low, high=sigma_high),
+                 Real(name='lamda', low=lamda_low, high=lamda_high)]), n_calls=n_calls,
+                                         n_initial_points=n_initial_points, n_points=n_points,
+                                         random_state=random_state).x
+        else:
+            lamdas = numpy.geomspace(lamda_low, lamda_high, n_lamdas)
+            [sigma] = gp_minimize(lambda args: cv_path(args[0], lamdas).min(),
+                                  Space([Real(name='sigma', low=sigma_low, high=sigma_high)]), n_calls=n_calls,
+                                  n_initial_points=n_initial_points, n_points=n_points, random_state=random_state).x
+            lamda = lamdas[cv_path(sigma, lamdas).argmin()]
+    return sigma, lamda, krr(X_train, y_train, X_test, lamda, sigma, approx, n_components, feature_seed)
+
+
+def gs_m(data, var_missing, threshold=0.1, ci_cache=None, n_jobs=1, timing=None):
+    """
+    @param data: input data_bn that might contain missing values
+    @param var_missing: names of the variables with missing values
+    @param threshold: threshold of conditional independence test
+    @param ci_cache: cache of conditional independence test results (see ci_cache.py), a new MemoryCache if None
+    @param n_jobs: number of processes searching the Markov blankets of different variables, -1 for all cores, each
+    with its own MemoryCache in place of ci_cache
+    @param timing: dictionary filled with the search time in seconds of each variable in var_missing, if not None
+    @return: dictionary of the Markov blanket learned by grow-shrink on complete cases for each variable in var_missing
+    """
+    if n_jobs != 1 and len(var_missing) > 1:
+        n_jobs = min(n_jobs if n_jobs > 0 else os.cpu_count(), len(var_missing))
+        # every worker takes a strided share of the variables, the results are merged in the order of var_missing
+        with ProcessPoolExecutor(n_jobs) as executor:
+            results = list(executor.map(gs_m_timed, [data] * n_jobs, [var_missing[i::n_jobs] for i in range(n_jobs)],
+                                        [threshold] * n_jobs))
+        mb, times = {}, {}
+        for result in results:
+            mb.update(result[0])
+            times.update(result[1])
+        if timing is not None:
+            timing.update({var: times[var] for var in var_missing})
+        return {var: mb[var] for var in var_missing}
+    if all(data.dtypes == 'category'):
+        # the degrees of freedom count the levels of the factors, as ci.test of bnlearn in missForest.R
+        ci_test = GTest(data.apply(lambda x: x.cat.codes).to_numpy(), [len(data[v].cat.categories) for v in data])
+    elif all(data.dtypes != 'category'):
+        ci_test = GaussianCITest(data.to_numpy())
+    else:
+        raise Exception('Mixed type of data_bn is not supported.')
+    if ci_cache is None:
+        ci_cache = MemoryCache()
+    varnames = list(data.columns)
+    digests = column_digests(ci_test.data, varnames)
+
+    def p_value(x, y, z):
+        cols = [varnames.index(v) for v in [x, y] + z]
+        if ci_test.count(cols) <= 2:
+            return 0
+        key = ci_key(ci_test.name, [x, y] + z, digests, ci_test.index.words(cols))
+        p = ci_cache.get(key)
+        if p is None:
+            p = ci_test(cols)
+            ci_cache.set(key, p)
+        return p
+
+    mb = {}
+    for var in var_missing:
+        start = time.perf_counter()
+        # forward
+        mb[var] = []
+        candidate = {v: 0 for v in data.columns if v != var}
+        while True:
+            for can in candidate:
+                candidate[can] = p_value(var, can, mb[var])
+            if min(candidate.values()) < threshold:
+                mb[var].append(min(candidate, key=candidate.get))
+                del candidate[mb[var][-1]]
+                if len(candidate) == 0:
+                    break
+            else:
+                break
+        # backward
+        candidate = {v: 0 for v in mb[var][: -1]}
+        for can in candidate:
+            if p_value(var, can, [x for x in mb[var] if x != can]) >= threshold:
+                mb[var].remove(can)
+        if timing is not None:
+            timing[var] = time.perf_counter() - start
+    ci_cache.flush()
+    return mb
+
+
+def gs_m_timed(data, var_missing, threshold=0.1):
+    """
+    @return: Markov blankets learned by gs_m and the search time of each variable
+    """
+    timing = {}
+    return gs_m(data, var_missing, threshold, timing=timing), timing
 
 
 def krr_iterative_imputation(data, prune='complete', k=5, threshold=0.1, max_iteration=10, lamda=0.1, sigma=20, bo=True,
                              sigma_low=1, sigma_high=30, lamda_low=0.01, lamda_high=0.4, n_calls=20,
-                             n_initial_points=10, n_points=1000):
+                             n_initial_points=10, n_points=1000, n_lamdas=None, cv='kfold', n_jobs=1,
+                             sweep='gauss-seidel', approx=None, n_components=100, update_rank=0.05,
+                             ci_cache=None, predictors=None, tuned=None, random_state=None):
     """
     @param data: input data_bn that might contain missing values
     @param prune: whether to prune unrelated variables as the dependent variable of the target variable
@@ -65,8 +465,33 @@ def krr_iterative_imputation(data, prune='complete', k=5, threshold=0.1, max_ite
     @param n_calls: maximum number of calls for Bayesian Optimization
     @param n_initial_points: number of initial points generated by Bayesian Optimization
     @param n_points: number of points searched by Bayesian Optimization in one step
+    @param n_lamdas: if given, Bayesian Optimization only searches sigma and lamda is picked from n_lamdas log-spaced
+    values between lamda_low and lamda_high, all evaluated from one eigendecomposition per fold
+    @param cv: cross validation used by Bayesian Optimization, 'kfold' for k-fold, 'loo' for closed-form leave-one-out
+    or 'gcv' for generalized cross validation, the latter two need a single factorization per trial
+    @param n_jobs: number of worker processes, -1 for all cores. If n_jobs != 1, the Markov blankets of the partial
+    pruning (unless ci_cache is given) are searched in parallel, and with the 'jacobi' sweep also the hyperparameters,
+    first-pass imputations and re-imputations of the variables. The result does not depend on n_jobs
+    @param sweep: order of the first pass and of the refinement sweeps, 'gauss-seidel' tunes and imputes the variables
+    one after another, each on the imputations of the previous ones, while 'jacobi' tunes all of them on the
+    mean-imputed data and re-imputes all of them from the previous sweep at the same time
+    @param approx: None for exact KRR, 'nystroem' or 'rff' to approximate the RBF kernel with Nystroem landmarks or
+    random Fourier features, so that fitting and predicting scale linearly with the number of rows
+    @param n_components: number of landmarks or random features of the kernel approximation
+    @param update_rank: largest fraction of modified training rows for which the exact KRR of a gauss-seidel sweep is
+    updated by a low-rank correction instead of being refitted. The Cholesky factor of a variable is only kept across
+    sweeps if its training rows with imputed predictors are at most this fraction, other variables are refitted
+    @param ci_cache: cache of conditional independence test results used by the partial pruning, pass a
+    ci_cache.SQLiteCache to reuse the results across runs on the same data (see ci_cache.ci_key)
+    @param predictors: dictionary of the predictors of the variables, which replace the pruning for these variables
+    @param tuned: dictionary filled with the tuned sigma and lamda of each variable with missing values, if not None
+    @param random_state: seed of Bayesian Optimization and of the kernel approximation for reproducible results
     @return: imputed data_bn
     """
+    if cv not in ['kfold', 'loo', 'gcv']:
+        raise Exception(cv + ' cross validation is undefined.')
+    if sweep not in ['gauss-seidel', 'jacobi']:
+        raise Exception(sweep + ' sweep is undefined.')
     data_imputed = data.fillna(data.mean())
     # var_missing = data_bn.columns[data_bn.isnull().any()].tolist()
     var_missing = data.isnull().sum(axis=0).sort_values()
@@ -78,104 +503,118 @@ def krr_iterative_imputation(data, prune='complete', k=5, threshold=0.1, max_ite
     sigma_dict = {var: 1 for var in var_missing}
     lamda_dict = {var: 0.1 for var in var_missing}
     predictor_dict = {var: data.columns[data.columns != var].to_list() for var in var_missing}
-    if prune == 'partial':
-        if all(data.dtypes == 'category'):
-            ci_test = g_test
-            data_numpy = data.apply(lambda x: x.cat.codes).to_numpy()
-        elif all(data.dtypes != 'category'):
-            ci_test = cor_test
-            data_numpy = data.to_numpy()
-        else:
-            raise Exception('Mixed type of data_bn is not supported.')
-        varnames = list(data.columns)
-        cache = {}
-        for var in var_missing:
-            # forward
-            predictor_dict[var] = []
-            candidate = {v: 0 for v in data.columns if v != var}
-            while True:
-                for can in candidate:
-                    if tuple(sorted([var, can])) not in cache:
-                        cache[tuple(sorted([var, can]))] = {}
-                    if tuple(sorted(predictor_dict[var])) not in cache[tuple(sorted([var, can]))]:
-                        cols = [varnames.index(x) for x in [var, can] + predictor_dict[var]]
-                        cache[tuple(sorted([var, can]))][tuple(sorted(predictor_dict[var]))] = ci_test(
-                            data_numpy[~numpy.isnan(data_numpy[:, cols]).any(axis=1), :], cols) if sum(
-                            ~numpy.isnan(data_numpy[:, cols]).any(axis=1)) > 2 else 0
-                    candidate[can] = cache[tuple(sorted([var, can]))][tuple(sorted(predictor_dict[var]))]
-                if min(candidate.values()) < threshold:
-                    predictor_dict[var].append(min(candidate, key=candidate.get))
-                    del candidate[predictor_dict[var][-1]]
-                    if len(candidate) == 0:
-                        break
-                else:
-                    break
-            # backward
-            candidate = {v: 0 for v in predictor_dict[var][: -1]}
-            for can in candidate:
-                con = [x for x in predictor_dict[var] if x != can]
-                if tuple(sorted(con)) not in cache[tuple(sorted([var, can]))]:
-                    cols = [varnames.index(x) for x in [var, can] + con]
-                    cache[tuple(sorted([var, can]))][tuple(sorted(con))] = ci_test(data_numpy, cols) if sum(
-                        ~numpy.isnan(data_numpy[:, cols]).any(axis=1)) > 2 else 0
-                if cache[tuple(sorted([var, can]))][tuple(sorted(con))] >= threshold:
-                    predictor_dict[var].remove(can)
+    if predictors is not None:
+        predictor_dict.update({var: list(predictors[var]) for var in var_missing if var in predictors})
+    elif prune == 'partial':
+        predictor_dict.update(gs_m(data, var_missing, threshold, ci_cache, n_jobs if ci_cache is None else 1))
     elif prune == 'complete':
+        # R is only needed for the structure learning of bnlearn
+        from rpy2.robjects import pandas2ri
+        from rpy2.robjects.packages import importr
+        pandas2ri.activate()
+        bnlearn = importr('bnlearn')
         learned = bnlearn.pc_stable(data, alpha=threshold)
         for var in var_missing:
             predictor_dict[var] = list(bnlearn.mb(learned, var))
     elif prune != 'None':
         raise Exception(prune + ' pruning method is undefined.')
-    for var in var_missing:
-        data_train = data_imputed.loc[~data[var].isnull()].reset_index(drop=True)
-        data_test = data_imputed.loc[data[var].isnull()].reset_index(drop=True)
-        idx_chunks = list(chunks(list(range(len(data_train))), k))
-
-        def cv_mse(args):
-            sigma = args[0]
-            lamda = args[1]
-            mse = 0
-            for i in range(k):
-                test_id = idx_chunks[i]
-                train_id = list(chain.from_iterable([x for j, x in enumerate(idx_chunks) if j != i]))
-                imputed = krr_numpy(data_train.loc[train_id, predictor_dict[var]].to_numpy(),
-                                    data_train.loc[train_id, var].to_numpy(),
-                                    data_train.loc[test_id, predictor_dict[var]].to_numpy(), lamda, sigma)
-                mse += data_train.loc[test_id, var].sub(imputed).pow(2).sum() / len(test_id) / k
-            return mse
-
-        if bo:
-            # find the optimal hyperparameters for KRR via Bayesian Optimization
-            [sigma_dict[var], lamda_dict[var]] = gp_minimize(cv_mse, Space(
-                [Real(name='sigma', low=sigma_low, high=sigma_high),
-                 Real(name='lamda', low=lamda_low, high=lamda_high)]), n_calls=n_calls,
-                                                             n_initial_points=n_initial_points, n_points=n_points).x
-        else:
-            sigma_dict[var] = sigma
-            lamda_dict[var] = lamda
-        data_imputed.loc[missing_idx[var]['missing'], var] = krr_numpy(data_train[predictor_dict[var]].to_numpy(),
-                                                                       data_train[var].to_numpy(),
-                                                                       data_test[predictor_dict[var]].to_numpy(),
-                                                                       lamda_dict[var], sigma_dict[var])
-        # print('lamda', lamda_dict[var])
-        # print('sigma', sigma_dict[var])
-    diff = numpy.Inf
-    i = 1
-    while True:
-        data_cache = deepcopy(data_imputed)
-        for var in var_missing:
-            # impute missing value by KRR
-            data_imputed.loc[missing_idx[var]['missing'], var] = krr_numpy(
-                data_imputed.loc[~data[var].isnull(), predictor_dict[var]].to_numpy(),
-                data_imputed.loc[~data[var].isnull(), var].to_numpy(),
-                data_imputed.loc[data[var].isnull(), predictor_dict[var]].to_numpy(), lamda_dict[var], sigma_dict[var])
-        if data_cache.sub(data_imputed).pow(2).sum().sum() > diff:
-            break
+    tune_params = dict(k=k, lamda=lamda, sigma=sigma, bo=bo, sigma_low=sigma_low, sigma_high=sigma_high,
+                       lamda_low=lamda_low, lamda_high=lamda_high, n_calls=n_calls, n_initial_points=n_initial_points,
+                       n_points=n_points, n_lamdas=n_lamdas, cv=cv, approx=approx, n_components=n_components)
+    # one seed per variable, so that the results do not depend on the scheduling of the workers
+    seeds = numpy.random.RandomState(random_state).randint(numpy.iinfo(numpy.int32).max, size=len(
+        var_missing)).tolist() if random_state is not None else [None] * len(var_missing)
+
+    def krr_inputs(frame, var):
+        # training predictors, training targets and test predictors of var
+        return (frame.loc[~data[var].isnull(), predictor_dict[var]].to_numpy(),
+                frame.loc[~data[var].isnull(), var].to_numpy(),
+                frame.loc[data[var].isnull(), predictor_dict[var]].to_numpy())
+
+    # the gauss-seidel schedule is sequential, only the jacobi sweeps are run by the workers
+    parallel = n_jobs != 1 and sweep == 'jacobi'
+    with ProcessPoolExecutor(n_jobs if n_jobs > 0 else None) if parallel else nullcontext() as executor:
+        if executor is None:
+            # jacobi tunes every variable on the mean-imputed data, as the workers do
+            frame = data_imputed if sweep == 'gauss-seidel' else data_imputed.copy()
+            for var, seed in zip(var_missing, seeds):
+                sigma_dict[var], lamda_dict[var], data_imputed.loc[missing_idx[var]['missing'], var] = tune_krr(
+                    *krr_inputs(frame, var), random_state=seed, **tune_params)
         else:
-            diff = data_cache.sub(data_imputed).pow(2).sum().sum()
-        i += 1
-        if i > max_iteration:
-            break
+            futures = {var: executor.submit(tune_krr, *krr_inputs(data_imputed, var), random_state=seed, **tune_params)
+                       for var, seed in zip(var_missing, seeds)}
+            for var in var_missing:
+                sigma_dict[var], lamda_dict[var], data_imputed.loc[missing_idx[var]['missing'], var] = futures[
+                    var].result()
+        if tuned is not None:
+            tuned.update({var: (sigma_dict[var], lamda_dict[var]) for var in var_missing})
+        # seeds of the kernel approximation in the refinement sweeps
+        seeds = [numpy.random.RandomState(seed).randint(numpy.iinfo(numpy.int32).max) for seed in seeds]
+        # only the missing cells change during the refinement, so keep their values instead of copying the data
+        imputed = {var: data_imputed.loc[missing_idx[var]['missing'], var].to_numpy() for var in var_missing}
+        # a variable is only re-imputed if the version of one of its predictors changed since its last fit
+        version = dict.fromkeys(data.columns, 0)
+        fitted = dict.fromkeys(var_missing)
+        models = {}
+        # training rows of each variable with an imputed predictor, the only ones which change between sweeps
+        changing = {var: int(data.loc[~data[var].isnull(), predictor_dict[var]].isnull().any(axis=1).sum())
+                    for var in var_missing}
+
+        def refit(var, X_train, y_train, X_test, seed):
+            # the factor of the kernel is only kept if the next sweeps can update it by a low-rank correction
+            if approx is not None or changing[var] > update_rank * len(X_train):
+                return krr(X_train, y_train, X_test, lamda_dict[var], sigma_dict[var], approx, n_components, seed)
+            if var in models:
+                models[var].update(X_train)
+            else:
+                models[var] = IncrementalKRR(lamda_dict[var], sigma_dict[var], update_rank).fit(X_train, y_train)
+            return models[var].predict(X_test)
+
+        def outdated(var):
+            return fitted[var] != [version[v] for v in predictor_dict[var]]
+
+        def assign(var, y_pred):
+            # store the new imputations of var and return their squared change
+            data_imputed.loc[missing_idx[var]['missing'], var] = y_pred
+            if not numpy.array_equal(y_pred, imputed[var]):
+                version[var] += 1
+            change = numpy.square(imputed[var] - y_pred).sum()
+            imputed[var] = y_pred
+            return change
+
+        diff = numpy.Inf
+        i = 1
+        while True:
+            todo = [(var, seed) for var, seed in zip(var_missing, seeds) if sweep == 'gauss-seidel' or outdated(var)]
+            diff_new = 0
+            if sweep == 'jacobi':
+                # every variable is re-imputed from the imputations of the previous sweep
+                inputs = [krr_inputs(data_imputed, var) for var, _ in todo]
+                for var, _ in todo:
+                    fitted[var] = [version[v] for v in predictor_dict[var]]
+                # refitted from scratch as by the workers, so that the result does not depend on n_jobs
+                if executor is None or len(todo) == 0:
+                    y_preds = [krr(*args, lamda_dict[var], sigma_dict[var], approx, n_components, seed)
+                               for (var, seed), args in zip(todo, inputs)]
+                else:
+                    y_preds = executor.map(krr, *zip(*[args + (lamda_dict[var], sigma_dict[var], approx, n_components,
+                                                               seed) for (var, seed), args in zip(todo, inputs)]))
+                for (var, _), y_pred in zip(todo, list(y_preds)):
+                    diff_new += assign(var, y_pred)
+            else:
+                for var, seed in todo:
+                    # predictors imputed earlier in this sweep may have changed
+                    if outdated(var):
+                        fitted[var] = [version[v] for v in predictor_dict[var]]
+                        # impute missing value by KRR
+                        diff_new += assign(var, refit(var, *krr_inputs(data_imputed, var), seed))
+            if diff_new > diff:
+                break
+            else:
+                diff = diff_new
+            i += 1
+            if i > max_iteration or diff == 0:
+                break
     return data_imputed
 
 
@@ -0,0 +1,124 @@
+"""
+Agreement of the p values of the CI tests of ci_tests.py, as used by gs_m and find_causes, with ci.test of bnlearn
+('mi' for discrete data, 'cor' for continuous data) on random tests of data with missing values. Every test is run by
+bnlearn on the complete rows of its columns, whose factors keep all their levels. Without R (or with --reference),
+the p values are compared with reference implementations of the same statistics instead: the G statistic summed
+over the strata of the conditioning set by scipy with the degrees of freedom of the levels of the factors, and the
+partial correlation test of bnsl (pingouin).
+
+$ python3 benchmarks/ci_tests_bnlearn.py --data_size 1000 --width 10 --n_tests 500
+"""
+import argparse
+import os
+import sys
+
+import numpy
+import pandas
+from bnsl.accessory import cor_test
+from scipy.stats import chi2, chi2_contingency
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ci_tests import GaussianCITest, GTest
+
+
+def sample(data_size, width, kind, missing_rate, seed=0):
+    """
+    @return: data sampled from a random DAG, every other variable partially observed. Discrete variables have an
+    unobserved level, which is counted by the degrees of freedom
+    """
+    rng = numpy.random.default_rng(seed)
+    data = numpy.empty((data_size, width))
+    for j in range(width):
+        parents = rng.choice(j, size=min(j, 2), replace=False) if j else []
+        data[:, j] = sum(rng.normal() * data[:, p] for p in parents) + rng.normal(size=data_size)
+    data = pandas.DataFrame(data, columns=['X' + str(j) for j in range(width)])
+    if kind == 'discrete':
+        data = data.apply(lambda x: pandas.Categorical(pandas.qcut(x, 3, labels=['a', 'b', 'c']),
+                                                       categories=['a', 'b', 'c', 'd']))
+    for j in range(0, width, 2):
+        data.iloc[rng.random(data_size) < missing_rate, j] = numpy.nan
+    return data
+
+
+def reference(data, cols):
+    """
+    @return: p value of the reference implementation of the test of cols ordered as [x, y, conditioning set], on the
+    complete rows of cols
+    """
+    frame = data.iloc[:, cols].dropna()
+    if not all(data.dtypes == 'category'):
+        return cor_test(frame.to_numpy(), list(range(len(cols))))
+    levels = [len(data.iloc[:, c].cat.categories) for c in cols]
+    G = 0
+    strata = frame.groupby(list(frame.columns[2:]), observed=True) if len(cols) > 2 else [(None, frame)]
+    for _, stratum in strata:
+        table = pandas.crosstab(stratum.iloc[:, 0], stratum.iloc[:, 1])
+        if min(table.shape) > 1:
+            G += chi2_contingency(table, correction=False, lambda_='log-likelihood')[0]
+    return chi2.sf(G, (levels[0] - 1) * (levels[1] - 1) * int(numpy.prod(levels[2:])))
+
+
+def bnlearn_test(data, cols):
+    """
+    @return: p value of ci.test of bnlearn for cols ordered as [x, y, conditioning set], on the complete rows of cols
+    """
+    frame = ro.conversion.py2rpy(data.iloc[:, cols].dropna())
+    names = list(data.columns[cols])
+    test = 'mi' if all(data.dtypes == 'category') else 'cor'
+    if len(cols) == 2:
+        result = bnlearn.ci_test(names[0], names[1], data=frame, test=test)
+    else:
+        result = bnlearn.ci_test(names[0], names[1], ro.StrVector(names[2:]), data=frame, test=test)
+    return result.rx2('p.value')[0]
+
+
+def compare(data, n_tests, compared, seed=0):
+    if all(data.dtypes == 'category'):
+        ci_test = GTest(data.apply(lambda x: x.cat.codes).to_numpy(), [len(data[v].cat.categories) for v in data])
+    else:
+        ci_test = GaussianCITest(data.to_numpy())
+    rng = numpy.random.default_rng(seed)
+    result = []
+    for _ in range(n_tests):
+        cols = rng.choice(data.shape[1], size=rng.integers(2, 6), replace=False).tolist()
+        result.append([len(cols) - 2, ci_test(cols), compared(data, cols)])
+    return pandas.DataFrame(result, columns=['conditioning_size', 'p_python', 'p_compared'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_size', default=1000, type=int)
+    parser.add_argument('--width', default=10, type=int)
+    parser.add_argument('--missing_rate', default=0.2, type=float)
+    parser.add_argument('--n_tests', default=500, type=int)
+    parser.add_argument('--reference', help='compare with the reference implementations even if R is available',
+                        action='store_true')
+    parser.add_argument('--output', help='csv file to save the p values', default=None, type=str)
+    args = parser.parse_args()
+
+    compared, name = reference, 'reference'
+    if not args.reference:
+        try:
+            import rpy2.robjects as ro
+            from rpy2.robjects import pandas2ri
+            from rpy2.robjects.packages import importr
+            pandas2ri.activate()
+            bnlearn = importr('bnlearn')
+            compared, name = bnlearn_test, 'bnlearn'
+        except ImportError:
+            print('rpy2 is not available, comparing with the reference implementations')
+    results = []
+    for kind in ['discrete', 'continuous']:
+        data = sample(args.data_size, args.width, kind, args.missing_rate)
+        result = compare(data, args.n_tests, compared)
+        result.insert(0, 'kind', kind)
+        results.append(result)
+    results = pandas.concat(results)
+    results['difference'] = (results['p_python'] - results['p_compared']).abs()
+    # decisions at the threshold of MBFS
+    results['same_decision'] = (results['p_python'] < 0.1) == (results['p_compared'] < 0.1)
+    print('p values of ci_tests.py against', name)
+    print(results.groupby('kind').agg(tests=('difference', 'size'), max_difference=('difference', 'max'),
+                                      same_decision=('same_decision', 'mean')).to_string())
+    if args.output is not None:
+        results.to_csv(args.output, index=False)
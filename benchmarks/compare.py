@@ -0,0 +1,85 @@
+"""
+Compares two result files of benchmarks/suite.py, e.g. of two commits. The time of every stage and the peak memory of
+each case are averaged (median) over the repetitions, and the metrics of the new results which are slower or larger by
+more than the tolerance, and by more than the noise floor, are reported as regressions.
+
+$ python3 benchmarks/compare.py baseline.json new.json --tolerance 0.2
+"""
+import argparse
+import json
+import sys
+
+import pandas
+
+# parameters identifying a case, the seed only differs between repetitions
+case_columns = ['algorithm', 'data_name', 'kind', 'data_size', 'width', 'missing_type', 'error_rate', 'maxiter',
+                'ntree', 'n_calls', 'approx', 'n_components', 'gain_iterations']
+
+
+def metrics(path):
+    """
+    @param path: json file saved by benchmarks/suite.py
+    @return: median of the metrics of each case over its repetitions, one row per case and metric
+    """
+    with open(path) as f:
+        results = json.load(f)['results']
+    rows = []
+    for result in results:
+        if result['status'] != 'done':
+            continue
+        case = [result.get(column) for column in case_columns]
+        rows.append(case + ['time', result['time']])
+        rows.extend(case + [name, stage['time']] for name, stage in result['stages'].items())
+        rows.append(case + ['peak_rss_mb', result['peak_rss_mb']])
+        rows.append(case + ['memory_mb', result['memory_mb']])
+        rows.append(case + ['error', result['error']])
+    data = pandas.DataFrame(rows, columns=case_columns + ['metric', 'value'])
+    # None (e.g. the width of a Bayesian network) would be dropped by groupby
+    data[case_columns] = data[case_columns].astype(str)
+    return data.groupby(case_columns + ['metric'], sort=False)['value'].median()
+
+
+def compare(base, new, tolerance=0.2, min_time=0.05, min_memory=10):
+    """
+    @param base: metrics of the baseline returned by metrics
+    @param new: metrics of the new results returned by metrics
+    @param tolerance: relative increase of a metric above which it is a regression
+    @param min_time: increase in seconds below which a time is not a regression
+    @param min_memory: increase in MB below which a memory is not a regression
+    @return: table of the metrics of the cases in both results, with their ratio and whether they regressed
+    """
+    table = pandas.concat([base.rename('base'), new.rename('new')], axis=1, join='inner').reset_index()
+    table['ratio'] = table['new'] / table['base']
+    floor = table['metric'].map(lambda metric: min_memory if metric.endswith('_mb') else min_time)
+    # the error is compared by its ratio only, it is not a performance metric
+    floor[table['metric'] == 'error'] = 0
+    table['regression'] = (table['new'] > table['base'] * (1 + tolerance)) & (table['new'] - table['base'] > floor)
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('base', help='json results of the baseline', type=str)
+    parser.add_argument('new', help='json results to compare with the baseline', type=str)
+    parser.add_argument('--tolerance', help='relative increase reported as a regression', default=0.2, type=float)
+    parser.add_argument('--min_time', help='seconds of increase below which times are noise', default=0.05,
+                        type=float)
+    parser.add_argument('--min_memory', help='MB of increase below which memory is noise', default=10, type=float)
+    parser.add_argument('--all', help='print all metrics, not only the regressions', action='store_true')
+    args = parser.parse_args()
+
+    table = compare(metrics(args.base), metrics(args.new), args.tolerance, args.min_time, args.min_memory)
+    # only the parameters which differ between the cases are printed
+    columns = ['algorithm'] + [column for column in case_columns[1:] if table[column].nunique() > 1] + [
+        'metric', 'base', 'new', 'ratio']
+    shown = table if args.all else table[table['regression']]
+    if len(shown):
+        print(shown[columns].to_string(index=False, float_format='%.3f'))
+    print(table['regression'].sum(), 'regressions in', len(table), 'metrics of', len(table.groupby(case_columns)),
+          'cases')
+    for name, results in [('base', args.base), ('new', args.new)]:
+        # cases which were only run, or only succeeded, in one of the results are not compared
+        unmatched = set(metrics(results).index.droplevel('metric')) - set(table.set_index(case_columns).index)
+        if unmatched:
+            print(len(unmatched), 'cases only in', results)
+    sys.exit(1 if table['regression'].any() else 0)
@@ -0,0 +1,87 @@
+"""
+Time of the discrete grow-shrink search of gs_m with the cached contingency tables of ci_tests.GTest against the
+baseline G-test of bnsl (g_test on the complete rows of every test, the results being cached by gs_m either way). The
+data are categorical, sampled from a random DAG in which every variable is a noisy function of up to three parents,
+and every other variable is partially observed. The Markov blankets found by both must be the same.
+
+$ python3 benchmarks/gtest_cache.py --data_size 2000 --width 80 --missing_rate 0.1
+"""
+import argparse
+import os
+import sys
+import time
+from unittest import mock
+
+import numpy
+import pandas
+from bnsl.accessory import g_counter, g_test
+from scipy.stats import chi2
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import accessories
+from ci_tests import CITest, GTest
+
+
+class BaselineGTest(CITest):
+    """
+    G-test of bnsl on the complete rows of the tested columns, as before the contingency tables were cached, with the
+    degrees of freedom of the levels of the factors if given
+    """
+    name = 'g_test'
+
+    def __init__(self, data, levels=None):
+        data = numpy.asarray(data)
+        super().__init__(data, data < 0)
+        self.levels = levels
+
+    def __call__(self, cols):
+        data = self.data[self.rows(cols)][:, cols]
+        if self.levels is None:
+            return g_test(data, list(range(len(cols))))
+        G, dof = g_counter(data, numpy.asarray(self.levels)[cols], numpy.arange(len(cols)))
+        return chi2.sf(G, dof)
+
+
+def sample(data_size, width, missing_rate, seed=0):
+    """
+    @return: categorical data with missing values sampled from a random DAG
+    """
+    rng = numpy.random.default_rng(seed)
+    arities = rng.integers(2, 5, size=width)
+    data = numpy.empty((data_size, width), dtype=int)
+    for j in range(width):
+        parents = rng.choice(j, size=min(j, 3), replace=False) if j else []
+        code = sum((k + 1) * data[:, p] for k, p in enumerate(parents)) if len(parents) else 0
+        noise = rng.random(data_size) < 0.3
+        data[:, j] = numpy.where(noise, rng.integers(0, arities[j], size=data_size), code % arities[j])
+    data = pandas.DataFrame(data, columns=['X' + str(j) for j in range(width)]).astype('category')
+    for j in range(0, width, 2):
+        data.iloc[rng.random(data_size) < missing_rate, j] = numpy.nan
+    return data
+
+
+def run(data, ci_test):
+    var_missing = data.columns[data.isnull().any()].tolist()
+    with mock.patch.object(accessories, 'GTest', ci_test):
+        start = time.perf_counter()
+        mb = accessories.gs_m(data, var_missing)
+        return time.perf_counter() - start, mb
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_size', default=2000, type=int)
+    parser.add_argument('--width', default=80, type=int)
+    parser.add_argument('--missing_rate', default=0.1, type=float)
+    parser.add_argument('--repetitions', default=3, type=int)
+    args = parser.parse_args()
+
+    data = sample(args.data_size, args.width, args.missing_rate)
+    times = {'baseline': [], 'cached tables': []}
+    for _ in range(args.repetitions):
+        times['baseline'].append(run(data, BaselineGTest)[0])
+        times['cached tables'].append(run(data, GTest)[0])
+    mb_baseline, mb_cached = run(data, BaselineGTest)[1], run(data, GTest)[1]
+    for name, values in times.items():
+        print('%-15s median %.2f s (min %.2f s)' % (name, numpy.median(values), min(values)))
+    print('same Markov blankets:', mb_baseline == mb_cached)
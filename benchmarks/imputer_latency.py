@@ -0,0 +1,75 @@
+"""
+Latency of the single-record imputation of a fitted MBFSImputer (impute_records), against the data frame path
+(transform) on the same records. The imputer is fitted on the first rows of the data with missing values and every
+request is a later row with n_missing fields removed, the p50 and p99 latencies are reported in milliseconds.
+
+$ python3 benchmarks/imputer_latency.py --data_name breast --method krr --approx nystroem --requests 1000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy
+import pandas
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from imputer import MBFSImputer
+
+
+def latency(impute, requests):
+    """
+    @return: latency of impute on each request in milliseconds
+    """
+    times = []
+    for request in requests:
+        start = time.perf_counter()
+        impute(request)
+        times.append((time.perf_counter() - start) * 1000)
+    return numpy.array(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_name', default='breast', type=str)
+    parser.add_argument('--method', choices=['krr', 'missforest'], default='krr', type=str)
+    parser.add_argument('--approx', choices=['None', 'nystroem', 'rff'], default='None', type=str)
+    parser.add_argument('--n_components', help='number of landmarks or random features', default=100, type=int)
+    parser.add_argument('--train_size', help='number of rows the imputer is fitted on', default=400, type=int)
+    parser.add_argument('--error_rate', help='proportion of missing values of the training rows', default=0.1,
+                        type=float)
+    parser.add_argument('--n_missing', help='number of missing fields per request', default=1, type=int)
+    parser.add_argument('--batch_size', help='number of records per request', default=1, type=int)
+    parser.add_argument('--requests', default=1000, type=int)
+    parser.add_argument('--imputer', help='load a saved MBFSImputer instead of fitting one', default=None, type=str)
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+
+    rng = numpy.random.RandomState(args.seed)
+    data = pandas.read_csv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data',
+                                        args.data_name + '.csv'))
+    if args.imputer is not None:
+        imputer = MBFSImputer.load(args.imputer)
+    else:
+        params = {'approx': None if args.approx == 'None' else args.approx, 'n_components': args.n_components} if \
+            args.method == 'krr' else {}
+        train = data.iloc[: args.train_size]
+        start = time.perf_counter()
+        imputer = MBFSImputer(args.method, random_state=args.seed, **params).fit(
+            train.mask(rng.random_sample(train.shape) < args.error_rate))
+        print('fit time:', time.perf_counter() - start, 'seconds')
+
+    rows = data.iloc[args.train_size:] if len(data) > args.train_size else data
+    requests = []
+    for _ in range(args.requests):
+        batch = rows.iloc[rng.choice(len(rows), args.batch_size)].to_dict('records')
+        for record in batch:
+            for var in rng.choice(list(record), args.n_missing, replace=False):
+                record[var] = None
+        requests.append(batch if args.batch_size > 1 else batch[0])
+    frames = [pandas.DataFrame(request if args.batch_size > 1 else [request]) for request in requests]
+
+    for name, impute, inputs in [('impute_records', imputer.impute, requests), ('transform', imputer.transform, frames)]:
+        times = latency(impute, inputs)
+        print('%-15s p50 %8.3f ms   p99 %8.3f ms   mean %8.3f ms' % (
+            name, numpy.percentile(times, 50), numpy.percentile(times, 99), times.mean()))
@@ -0,0 +1,88 @@
+"""
+Accuracy-vs-speed tradeoff of approximate KRR (Nystroem landmarks and random Fourier features) against exact KRR
+(krr_numpy) on data sampled from a random nonlinear DAG with NumPy, where every variable is regressed on all the others,
+or from the shipped Bayesian networks (requires R), where every variable is regressed on its Markov blanket. The error
+of the predictions is measured against the held-out values (mse) and against the predictions of exact KRR
+(mse_to_exact), the latter only up to the largest data size fitted by exact KRR.
+
+$ python3 benchmarks/krr_approx.py --data_name synthetic --data_size 1000 3000 10000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy
+import pandas
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from accessories import krr, sq_dist
+from suite import synthetic_data
+
+
+def regressions(data_name, data_size, width, seed=0):
+    """
+    @return: standardized data of data_size rows and the predictors of each variable
+    """
+    if data_name == 'synthetic':
+        data = synthetic_data(data_size, width, seed=seed)
+        return data, {var: [v for v in data.columns if v != var] for var in data.columns}
+    import rpy2.robjects as ro
+    from rpy2.robjects import pandas2ri
+    from rpy2.robjects.packages import importr
+    pandas2ri.activate()
+    base, bnlearn = importr('base'), importr('bnlearn')
+    ro.r['set.seed'](seed)
+    model = base.readRDS(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'model', data_name + '.rds'))
+    data = ro.conversion.rpy2py(bnlearn.rbn(model, data_size))
+    data = (data - data.mean()) / data.std()
+    return data, {var: list(bnlearn.mb(model, var)) for var in data.columns}
+
+
+def run(data_name, data_size, methods, width=10, n_test=1000, lamda=0.1, max_exact=5000, seed=0):
+    data, predictors = regressions(data_name, data_size + n_test, width, seed)
+    result = []
+    for var in data.columns:
+        mb = predictors[var]
+        if len(mb) == 0:
+            continue
+        X, y = data[mb].to_numpy(), data[var].to_numpy()
+        X_train, y_train, X_test, y_test = X[: data_size], y[: data_size], X[data_size:], y[data_size:]
+        # median heuristic for the kernel width
+        sigma = numpy.sqrt(numpy.median(sq_dist(X_train[: 500])) / 2)
+        y_exact = None
+        for approx, n_components in methods:
+            if approx is None and data_size > max_exact:
+                continue
+            start = time.perf_counter()
+            y_pred = krr(X_train, y_train, X_test, lamda, sigma, approx, n_components, seed)
+            elapsed = time.perf_counter() - start
+            if approx is None:
+                y_exact = y_pred
+            result.append([var, approx if approx else 'exact', n_components, elapsed,
+                           numpy.mean(numpy.square(y_pred - y_test)),
+                           numpy.mean(numpy.square(y_pred - y_exact)) if y_exact is not None else numpy.nan])
+    result = pandas.DataFrame(result, columns=['variable', 'method', 'n_components', 'time', 'mse', 'mse_to_exact'])
+    result.insert(0, 'datasize', data_size)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_name', choices=['synthetic', 'ecoli70', 'arth150'], default='synthetic', type=str)
+    parser.add_argument('--data_size', nargs='+', default=[1000, 3000, 10000], type=int)
+    parser.add_argument('--width', help='number of variables of the synthetic data', default=10, type=int)
+    parser.add_argument('--n_components', nargs='+', default=[50, 100, 200, 500], type=int)
+    parser.add_argument('--max_exact', help='largest data size fitted by exact KRR', default=5000, type=int)
+    parser.add_argument('--output', help='csv file to save the results', default=None, type=str)
+    args = parser.parse_args()
+
+    methods = [(None, 0)] + [(approx, m) for approx in ['nystroem', 'rff'] for m in args.n_components]
+    results = pandas.concat([run(args.data_name, n, methods, args.width, max_exact=args.max_exact)
+                             for n in args.data_size])
+    summary = results.groupby(['datasize', 'method', 'n_components'], sort=False).agg(
+        time=('time', 'sum'), mse=('mse', 'mean'), mse_to_exact=('mse_to_exact', 'mean')).reset_index()
+    print(summary.to_string(index=False))
+    if args.output is not None:
+        results.to_csv(args.output, index=False)
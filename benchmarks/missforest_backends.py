@@ -0,0 +1,71 @@
+"""
+Imputation accuracy and runtime of the native python missForest (missforest.py) against the original missForest.R on
+the same missing data sets, for MF and MF+MBFS. Both backends are expected to agree up to the randomness of the
+forests, i.e. the mean RMSE of each setting should differ by much less than its standard deviation over repetitions.
+
+$ python3 benchmarks/missforest_backends.py --data_type synthetic --data_name ecoli70 --repetitions 10
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy
+import pandas
+import rpy2.robjects as ro
+from bnsl import add_missing
+from rpy2.robjects import pandas2ri
+from rpy2.robjects.packages import importr
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(root)
+from accessories import rmse
+from main import miss_mechanism
+from missforest import missforest
+
+pandas2ri.activate()
+base, bnlearn = importr('base'), importr('bnlearn')
+ro.r('source("' + os.path.join(root, 'missForest.R') + '")')
+
+
+def run(data_clean, missing_type, error_rate, fs, seed):
+    random.seed(seed)
+    numpy.random.seed(seed)
+    data_missing = add_missing(data_clean, miss_mechanism(list(data_clean.columns), missing_type), m_max=error_rate)
+    result = []
+    start = time.perf_counter()
+    data_imputed = missforest(data_missing, fs=fs, random_state=seed)[0]
+    result.append(['python', fs, seed, time.perf_counter() - start, rmse(data_clean, data_imputed, data_missing)])
+    start = time.perf_counter()
+    ro.r['set.seed'](seed)
+    data_imputed = ro.conversion.rpy2py(ro.globalenv['missForest'](ro.conversion.py2rpy(data_missing), fs=fs)[0])
+    result.append(['R', fs, seed, time.perf_counter() - start, rmse(data_clean, data_imputed, data_missing)])
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_type', choices=['synthetic', 'real-world'], default='synthetic', type=str)
+    parser.add_argument('--data_name', choices=['ecoli70', 'breast'], default='ecoli70', type=str)
+    parser.add_argument('--data_size', help='number of instance for synthetic data', default=1000, type=int)
+    parser.add_argument('--missing_type', choices=['MCAR', 'MAR', 'MNAR'], default='MAR', type=str)
+    parser.add_argument('--error_rate', help='maximum error rate', default=0.3, type=float)
+    parser.add_argument('--repetitions', default=10, type=int)
+    parser.add_argument('--output', help='csv file to save the results', default=None, type=str)
+    args = parser.parse_args()
+
+    if args.data_type == 'synthetic':
+        model = base.readRDS(os.path.join(root, 'model', args.data_name + '.rds'))
+        data_clean = ro.conversion.rpy2py(bnlearn.rbn(model, args.data_size))
+    else:
+        data_clean = pandas.read_csv(os.path.join(root, 'data', args.data_name + '.csv'))
+    results = pandas.DataFrame(
+        [row for seed in range(args.repetitions) for fs in ['None', 'mbfs']
+         for row in run(data_clean, args.missing_type, args.error_rate, fs, seed)],
+        columns=['backend', 'feature_selection', 'seed', 'time', 'rmse'])
+    summary = results.groupby(['feature_selection', 'backend'], sort=False).agg(
+        time=('time', 'mean'), rmse_mean=('rmse', 'mean'), rmse_std=('rmse', 'std')).reset_index()
+    print(summary.to_string(index=False))
+    if args.output is not None:
+        results.to_csv(args.output, index=False)
@@ -0,0 +1,281 @@
+"""
+Timing and peak memory baselines of the imputers (missForest with and without MBFS, KRR iterative imputation with and
+without MBFS, softImpute and GAIN) on synthetic data, swept over the number of rows and of variables, to detect
+performance regressions across commits. Every case runs in a fresh process and reports the time of each stage:
+- ci_tests: conditional independence tests
+- mb_discovery: search of the Markov blankets and of the causes of missingness, including its CI tests
+- tuning: Bayesian Optimization of the KRR hyperparameters, cross validation of the softImpute penalty
+- model_fits: fits of the random forests, KRR models, softImpute and GAIN
+- sweeps: time outside MB discovery and tuning, i.e. the iterative refinement including its model fits
+and the peak resident memory of the process, also relative to its memory before the imputation. The data are sampled
+from a random nonlinear DAG with NumPy, or from a shipped Bayesian network with bnlearn (requires R). The results are
+saved as JSON, compare two runs with benchmarks/compare.py.
+
+$ python3 benchmarks/suite.py --data_size 500 2000 --width 10 30 --output baseline.json
+"""
+import argparse
+import datetime
+import functools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from contextlib import contextmanager, ExitStack
+
+import numpy
+import pandas
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(root)
+sys.path.append(os.path.join(root, 'reproducible files'))
+
+algorithm_list = ['MF', 'MBMF', 'KRR', 'MBKRR', 'softImpute', 'GAIN']
+# algorithms for continuous data only
+continuous_list = ['KRR', 'MBKRR', 'softImpute', 'GAIN']
+
+
+class Profiler:
+    """
+    time and number of calls of the stages of an imputation. The time of a stage includes the stages nested in it,
+    its self_time excludes them
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.depth = {}
+        self.nested = []
+
+    @contextmanager
+    def stage(self, name):
+        record = self.stages.setdefault(name, {'time': 0.0, 'self_time': 0.0, 'calls': 0})
+        self.depth[name] = self.depth.get(name, 0) + 1
+        self.nested.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.depth[name] -= 1
+            # recursive calls of a stage are only counted once
+            if self.depth[name] == 0:
+                record['time'] += elapsed
+            record['self_time'] += elapsed - self.nested.pop()
+            record['calls'] += 1
+            if self.nested:
+                self.nested[-1] += elapsed
+
+    def wrap(self, function, name):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            with self.stage(name):
+                return function(*args, **kwargs)
+
+        return timed
+
+    @contextmanager
+    def patch(self, targets):
+        """
+        @param targets: list of (module or class, attribute, stage), the attributes are timed as the stage while the
+        context is active
+        """
+        with ExitStack() as stack:
+            for owner, attribute, name in targets:
+                original = getattr(owner, attribute)
+                setattr(owner, attribute, self.wrap(original, name))
+                stack.callback(setattr, owner, attribute, original)
+            yield self
+
+
+def synthetic_data(data_size, width, kind='gaussian', seed=0):
+    """
+    @param data_size: number of rows
+    @param width: number of variables
+    @param kind: 'gaussian' for continuous variables, 'discrete' for categorical variables with three categories
+    @return: data sampled from a random DAG in which every variable depends on up to two of the previous variables
+    """
+    rng = numpy.random.RandomState(seed)
+    X = numpy.empty((data_size, width))
+    for j in range(width):
+        parents = rng.choice(j, min(j, rng.randint(1, 3)), replace=False) if j > 0 else []
+        weights = rng.uniform(0.5, 1.5, len(parents)) * rng.choice([-1, 1], len(parents))
+        X[:, j] = numpy.tanh(X[:, parents]) @ weights + 0.5 * rng.normal(size=data_size)
+        X[:, j] = (X[:, j] - X[:, j].mean()) / X[:, j].std()
+    data = pandas.DataFrame(X, columns=['X' + str(j) for j in range(width)])
+    if kind == 'discrete':
+        data = data.apply(lambda x: pandas.Categorical(numpy.array(['a', 'b', 'c'])[
+            numpy.digitize(x, numpy.quantile(x, [1 / 3, 2 / 3]))]))
+    return data
+
+
+def load_data(case):
+    if case['data_name'] == 'synthetic':
+        return synthetic_data(case['data_size'], case['width'], case['kind'], case['seed'])
+    import rpy2.robjects as ro
+    from rpy2.robjects import pandas2ri
+    from rpy2.robjects.packages import importr
+    pandas2ri.activate()
+    base, bnlearn = importr('base'), importr('bnlearn')
+    ro.r['set.seed'](case['seed'])
+    model = base.readRDS(os.path.join(root, 'model', case['data_name'] + '.rds'))
+    return ro.conversion.rpy2py(bnlearn.rbn(model, case['data_size']))
+
+
+def impute(data_missing, case, profiler):
+    """
+    @return: imputed data, the stages of the imputers are timed by profiler
+    """
+    import accessories
+    import ci_tests
+    import missforest
+    targets = [(ci_tests.GaussianCITest, '__call__', 'ci_tests'), (ci_tests.GTest, '__call__', 'ci_tests'),
+               (accessories, 'gs_m', 'mb_discovery'), (missforest, 'gs_m', 'mb_discovery'),
+               (missforest, 'find_causes', 'mb_discovery'), (accessories, 'tune_krr', 'tuning'),
+               (missforest, 'grow_forest', 'model_fits'), (accessories, 'krr', 'model_fits'),
+               (accessories.IncrementalKRR, 'fit', 'model_fits'), (accessories.IncrementalKRR, 'update', 'model_fits')]
+    algorithm = case['algorithm']
+    with profiler.patch(targets):
+        if algorithm in ['MF', 'MBMF']:
+            return missforest.missforest(data_missing, maxiter=case['maxiter'], ntree=case['ntree'],
+                                         fs='None' if algorithm == 'MF' else 'mbfs', random_state=case['seed'])[0]
+        if algorithm in ['KRR', 'MBKRR']:
+            return accessories.krr_iterative_imputation(
+                data_missing, prune='None' if algorithm == 'KRR' else 'partial', max_iteration=case['maxiter'],
+                n_calls=case['n_calls'], approx=case['approx'], n_components=case['n_components'],
+                random_state=case['seed'])
+        if algorithm == 'softImpute':
+            from softimpute import softimpute, cv_softimpute
+            with profiler.stage('tuning'):
+                cv_error, grid_lambda = cv_softimpute(data_missing.to_numpy(), grid_len=5)
+            with profiler.stage('model_fits'):
+                data_imputed = softimpute(data_missing.to_numpy(), grid_lambda[numpy.argmin(cv_error)])[1]
+            return pandas.DataFrame(data_imputed, columns=data_missing.columns)
+        if algorithm == 'GAIN':
+            from GAIN.gain import gain
+            with profiler.stage('model_fits'):
+                data_imputed = gain(data_missing.to_numpy(), {'batch_size': 64, 'hint_rate': 0.9, 'alpha': 10,
+                                                              'iterations': case['gain_iterations']})
+            return pandas.DataFrame(data_imputed, columns=data_missing.columns)
+    raise Exception('Undefined method ' + algorithm + '.')
+
+
+def work(case, connection):
+    from bnsl import add_missing
+    from accessories import pfc, rmse
+    from main import miss_mechanism
+    try:
+        data_clean = load_data(case)
+        random.seed(case['seed'])
+        numpy.random.seed(case['seed'])
+        data_missing = add_missing(data_clean, miss_mechanism(list(data_clean.columns), case['missing_type']),
+                                   m_max=case['error_rate'])
+        # ru_maxrss is in kilobytes on Linux
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        profiler = Profiler()
+        start = time.perf_counter()
+        data_imputed = impute(data_missing, case, profiler)
+        total = time.perf_counter() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        stages = profiler.stages
+        stages['sweeps'] = {'time': total - sum(stages[name]['time'] for name in ['mb_discovery', 'tuning']
+                                                if name in stages)}
+        error = pfc(data_clean, data_imputed, data_missing) if case['kind'] == 'discrete' else rmse(
+            data_clean, data_imputed, data_missing)
+        result = {'status': 'done', 'time': total, 'stages': stages, 'peak_rss_mb': peak,
+                  'memory_mb': peak - baseline, 'error': error}
+    except Exception as e:
+        result = {'status': 'failed: ' + repr(e)}
+    connection.send(result)
+    connection.close()
+
+
+def run_case(case, timeout=None):
+    """
+    @param case: parameters of the benchmark, see cases
+    @param timeout: time in seconds after which the case is stopped, unlimited if None
+    @return: result of the case
+    """
+    # a fresh interpreter per case, so that the peak memory and the imports do not depend on the previous cases
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=work, args=(case, sender), daemon=True)
+    process.start()
+    sender.close()
+    if receiver.poll(timeout):
+        result = receiver.recv()
+    elif process.is_alive():
+        process.kill()
+        result = {'status': 'timeout'}
+    else:
+        result = {'status': 'crashed (exit code ' + str(process.exitcode) + ')'}
+    process.join()
+    receiver.close()
+    return dict(case, **result)
+
+
+def cases(args):
+    """
+    @return: parameters of every benchmark case of the command line arguments
+    """
+    widths = args.width if args.data_name == 'synthetic' else [None]
+    return [{'algorithm': algorithm, 'data_name': args.data_name, 'kind': args.kind, 'data_size': data_size,
+             'width': width, 'missing_type': args.missing_type, 'error_rate': args.error_rate,
+             'maxiter': args.maxiter, 'ntree': args.ntree, 'n_calls': args.n_calls,
+             'approx': None if args.approx == 'None' else args.approx, 'n_components': args.n_components,
+             'gain_iterations': args.gain_iterations, 'seed': args.seed + repetition}
+            for data_size in args.data_size for width in widths for algorithm in args.algorithms
+            if args.kind == 'gaussian' or algorithm not in continuous_list for repetition in range(args.repetitions)]
+
+
+def environment():
+    """
+    @return: commit and versions the results were measured with
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=root, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'numpy': numpy.__version__, 'pandas': pandas.__version__,
+            'machine': platform.machine(), 'cpu_count': os.cpu_count()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--algorithms', choices=algorithm_list, nargs='+', default=algorithm_list, type=str)
+    parser.add_argument('--data_name', help='synthetic for NumPy data, or a Bayesian network in the model folder',
+                        default='synthetic', type=str)
+    parser.add_argument('--kind', help='type of the synthetic variables', choices=['gaussian', 'discrete'],
+                        default='gaussian', type=str)
+    parser.add_argument('--data_size', help='numbers of rows', nargs='+', default=[500, 1000, 2000], type=int)
+    parser.add_argument('--width', help='numbers of synthetic variables', nargs='+', default=[10, 20], type=int)
+    parser.add_argument('--missing_type', choices=['MCAR', 'MAR', 'MNAR'], default='MAR', type=str)
+    parser.add_argument('--error_rate', help='maximum error rate', default=0.3, type=float)
+    parser.add_argument('--maxiter', help='maximum number of refinement sweeps', default=10, type=int)
+    parser.add_argument('--ntree', help='number of trees of missForest', default=100, type=int)
+    parser.add_argument('--n_calls', help='number of calls of Bayesian Optimization', default=20, type=int)
+    parser.add_argument('--approx', help='kernel approximation of KRR', choices=['None', 'nystroem', 'rff'],
+                        default='None', type=str)
+    parser.add_argument('--n_components', help='number of landmarks or random features', default=100, type=int)
+    parser.add_argument('--gain_iterations', help='number of training iterations of GAIN', default=1000, type=int)
+    parser.add_argument('--repetitions', default=1, type=int)
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('--timeout', help='seconds after which a case is stopped', default=None, type=float)
+    parser.add_argument('--output', help='json file to save the results', default=None, type=str)
+    args = parser.parse_args()
+
+    results = []
+    for case in cases(args):
+        results.append(run_case(case, args.timeout))
+        result = results[-1]
+        print(case['algorithm'], case['data_size'], case['width'], case['seed'], result['status'],
+              '' if result['status'] != 'done' else '%.2f s %.0f MB ' % (result['time'], result['peak_rss_mb']) +
+              ' '.join('%s %.2f s' % (name, stage['time']) for name, stage in result['stages'].items()))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'arguments': vars(args), 'results': results}, f, indent=1)
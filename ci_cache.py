@@ -0,0 +1,134 @@
+import collections
+import hashlib
+import os
+import sqlite3
+
+import numpy
+
+
+def column_digests(data, varnames):
+    """
+    @param data: data matrix
+    @param varnames: names of the columns of data
+    @return: dictionary of the digest of the name and values of each column, which fingerprints the dataset. The
+    digest covers the positions of the missing values, so the same variable with another missing rate has another digest
+    """
+    digests = {}
+    for i, var in enumerate(varnames):
+        digest = hashlib.blake2b(str(var).encode() + b'\0', digest_size=16)
+        digest.update(numpy.ascontiguousarray(data[:, i]).tobytes())
+        digests[var] = digest.digest()
+    return digests
+
+
+def ci_key(test, varnames, digests, rows):
+    """
+    @param test: name of the conditional independence test
+    @param varnames: names of the tested variables, ordered as [x, y, conditioning set]
+    @param digests: column digests of the dataset returned by column_digests
+    @param rows: packed mask of the rows used by the test
+    @return: key of the test result, which identifies the unordered pair, the conditioning set and the rows used.
+    A result is only reused for tested columns with the same values and missing values, i.e. across runs on the same
+    data, or across missing rates of a data set only for tests of columns which are complete in both
+    """
+    # the result is symmetric in x and y and does not depend on the order of the conditioning set
+    digest = hashlib.blake2b(test.encode(), digest_size=16)
+    for var in sorted(varnames[: 2]) + sorted(varnames[2:]):
+        digest.update(digests[var])
+    digest.update(numpy.ascontiguousarray(rows).tobytes())
+    return digest.hexdigest()
+
+
+class MemoryCache:
+    """
+    In-memory cache of conditional independence test results with least-recently-used eviction.
+    """
+
+    def __init__(self, max_size=None):
+        """
+        @param max_size: maximum number of cached results, unbounded if None
+        """
+        self.max_size = max_size
+        self.store = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key in self.store:
+            self.store.move_to_end(key)
+            self.hits += 1
+            return self.store[key]
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        self.store[key] = value
+        self.store.move_to_end(key)
+        if self.max_size is not None:
+            while len(self.store) > self.max_size:
+                self.store.popitem(last=False)
+
+    def __len__(self):
+        return len(self.store)
+
+    def flush(self):
+        pass
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self)}
+
+
+class SQLiteCache(MemoryCache):
+    """
+    On-disk cache of conditional independence test results shared across runs, with least-recently-used eviction.
+    """
+
+    def __init__(self, path, max_size=None):
+        """
+        @param path: path of the SQLite database
+        @param max_size: maximum number of cached results, unbounded if None
+        """
+        super().__init__(max_size)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS ci (key TEXT PRIMARY KEY, value REAL, used INTEGER)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS ci_used ON ci (used)')
+        # logical clock of the least-recently-used eviction
+        self.clock = self.connection.execute('SELECT COALESCE(MAX(used), 0) FROM ci').fetchone()[0]
+
+    def get(self, key):
+        row = self.connection.execute('SELECT value FROM ci WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.clock += 1
+        self.connection.execute('UPDATE ci SET used = ? WHERE key = ?', (self.clock, key))
+        return row[0]
+
+    def set(self, key, value):
+        self.clock += 1
+        self.connection.execute('INSERT OR REPLACE INTO ci VALUES (?, ?, ?)', (key, float(value), self.clock))
+        if self.clock % 1000 == 0:
+            self.flush()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM ci').fetchone()[0]
+
+    def flush(self):
+        # evict the least recently used results and write the cache to disk
+        if self.max_size is not None:
+            self.connection.execute('DELETE FROM ci WHERE key IN (SELECT key FROM ci ORDER BY used DESC LIMIT -1 '
+                                    'OFFSET ?)', (self.max_size,))
+        self.connection.commit()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,261 @@
+import collections
+import itertools
+
+import numpy
+from scipy.special import chdtrc
+from scipy.stats import t
+
+
+# number of set bits of every byte
+POPCOUNT = numpy.array([bin(i).count('1') for i in range(256)], dtype=numpy.uint8)
+
+
+class MissingIndex:
+    """
+    Observed rows of every column packed into numpy.uint64 words, so the complete-case rows of any set of columns are a
+    bitwise AND of a few words and their number a popcount. The row indices of each mask are cached, bounded by their
+    total number.
+    """
+
+    def __init__(self, missing, max_rows=10 ** 7):
+        """
+        @param missing: boolean matrix of the missing cells
+        @param max_rows: maximum total number of cached row indices
+        """
+        self.n = missing.shape[0]
+        self.incomplete = set(numpy.flatnonzero(missing.any(axis=0)))
+        packed = numpy.packbits(~missing.T, axis=1, bitorder='little')
+        packed = numpy.pad(packed, ((0, 0), (0, -packed.shape[1] % 8)))
+        self.bits = numpy.ascontiguousarray(packed).view(numpy.uint64)
+        self.all = numpy.packbits(numpy.pad(numpy.ones(self.n, dtype=bool), (0, self.bits.shape[1] * 64 - self.n)),
+                                  bitorder='little').view(numpy.uint64)
+        self.max_rows = max_rows
+        self.cached = 0
+        self.indices = collections.OrderedDict()
+
+    def words(self, cols):
+        """
+        @param cols: column indices
+        @return: packed mask of the rows where all columns in cols are observed
+        """
+        # fully observed columns do not restrict the rows
+        incomplete = sorted(self.incomplete.intersection(cols))
+        if len(incomplete) == 0:
+            return self.all
+        return numpy.bitwise_and.reduce(self.bits[incomplete], axis=0)
+
+    def count(self, cols):
+        return int(POPCOUNT[self.words(cols).view(numpy.uint8)].sum(dtype=numpy.int64))
+
+    def rows(self, cols):
+        key = frozenset(self.incomplete.intersection(cols))
+        if key in self.indices:
+            self.indices.move_to_end(key)
+        else:
+            mask = numpy.unpackbits(self.words(key).view(numpy.uint8), count=self.n, bitorder='little')
+            rows = self.indices[key] = numpy.flatnonzero(mask)
+            self.cached += len(rows)
+            while self.cached > self.max_rows and len(self.indices) > 1:
+                self.cached -= len(self.indices.popitem(last=False)[1])
+            return rows
+        return self.indices[key]
+
+
+class CITest:
+    """
+    Conditional independence test of two columns of a data matrix given a set of other columns, computed on the rows
+    where all of them are observed.
+    """
+    name = None
+
+    def __init__(self, data, missing=None):
+        """
+        @param data: data matrix
+        @param missing: boolean matrix of the missing cells, the NaN cells of data if None
+        """
+        self.data = data
+        self.index = MissingIndex(numpy.isnan(data) if missing is None else missing)
+
+    def rows(self, cols):
+        """
+        @param cols: column indices of the test
+        @return: indices of the rows where all columns in cols are observed
+        """
+        return self.index.rows(cols)
+
+    def count(self, cols):
+        """
+        @param cols: column indices of the test
+        @return: number of rows where all columns in cols are observed
+        """
+        return self.index.count(cols)
+
+    def __call__(self, cols):
+        """
+        @param cols: column indices ordered as [x, y, conditioning set]
+        @return: p value
+        """
+        raise NotImplementedError
+
+
+class GTest(CITest):
+    """
+    G-test of independence for integer-coded discrete data, computed from cached contingency tables. The statistic is
+    that of bnsl.accessory.g_test and of the 'mi' test of bnlearn, whose degrees of freedom count the levels of the
+    factors while bnsl counts the levels observed on the rows of the test. A joint count table is built once per set of
+    columns and missingness pattern, and the table of any subset of its columns on the same rows is derived by summing
+    out axes. Tables are looked up by their exact columns first, then among a bounded number of the latest tables of
+    the pattern sharing a column with the test. The cache is bounded by the total number of cells of the stored
+    tables.
+    """
+    name = 'g_test'
+
+    def __init__(self, data, levels=None, max_cells=10 ** 7, max_candidates=16):
+        """
+        @param data: integer-coded data matrix, missing values are negative codes
+        @param levels: number of levels of each column counted by the degrees of freedom as in bnlearn, if None the
+        levels observed on the rows of each test are counted as in bnsl
+        @param max_cells: maximum total number of cells of the cached contingency tables
+        @param max_candidates: maximum number of cached tables searched for a superset of the columns of a test
+        """
+        data = numpy.asarray(data)
+        super().__init__(data.astype(numpy.min_scalar_type(-int(data.max()) - 1)), data < 0)
+        self.levels = None if levels is None else numpy.asarray(levels)
+        if levels is not None:
+            # the p values differ from those of bnsl, they are cached apart
+            self.name = 'mi'
+        # with levels, the tables of a column have the same shape in every test
+        self.arities = None if levels is None else numpy.maximum(self.data.max(axis=0) + 1, 1)
+        self.max_cells = max_cells
+        self.max_candidates = max_candidates
+        self.cells = 0
+        # tables keyed by their missingness pattern and (sorted) columns
+        self.tables = collections.OrderedDict()
+        # keys of the tables of each pattern containing each column, in the order they were stored
+        self.postings = collections.defaultdict(lambda: collections.defaultdict(dict))
+
+    def superset(self, pattern, cols):
+        """
+        @return: key of the smallest cached table of pattern over a superset of cols among the latest tables containing
+        the rarest column of cols, None if none is smaller than a table of all the rows
+        """
+        postings = self.postings[pattern]
+        keys = min((postings[c] for c in cols), key=len)
+        best = None
+        for key in itertools.islice(reversed(keys), self.max_candidates):
+            if (best is None or self.tables[key].size < self.tables[best].size) and set(cols).issubset(key[1]):
+                best = key
+        return best if best is not None and self.tables[best].size <= self.index.n else None
+
+    def store(self, key, counts):
+        self.tables[key] = counts
+        self.cells += counts.size
+        for c in key[1]:
+            self.postings[key[0]][c][key] = None
+        while self.cells > self.max_cells:
+            evicted, counts = self.tables.popitem(last=False)
+            self.cells -= counts.size
+            for c in evicted[1]:
+                del self.postings[evicted[0]][c][evicted]
+
+    def table(self, cols):
+        """
+        @param cols: sorted column indices
+        @return: joint count table of cols on the rows where they are all observed, axes ordered as cols
+        """
+        key = (frozenset(self.index.incomplete.intersection(cols)), tuple(cols))
+        if key in self.tables:
+            self.tables.move_to_end(key)
+            return self.tables[key]
+        superset = self.superset(key[0], cols)
+        if superset is not None:
+            self.tables.move_to_end(superset)
+            axes = tuple(i for i, c in enumerate(superset[1]) if c not in cols)
+            return self.tables[superset].sum(axis=axes)
+        data = self.data[self.rows(cols)][:, cols].astype(numpy.intp)
+        if self.arities is not None:
+            arities = tuple(self.arities[cols])
+        else:
+            arities = tuple(data.max(axis=0) + 1) if len(data) else (1,) * len(cols)
+        counts = numpy.bincount(numpy.ravel_multi_index(data.T, arities),
+                                minlength=int(numpy.prod(arities))).reshape(arities)
+        if counts.size <= self.max_cells:
+            self.store(key, counts)
+        return counts
+
+    def __call__(self, cols):
+        order = sorted(range(len(cols)), key=lambda i: cols[i])
+        # axes ordered as [x, y, conditioning set]
+        N_xyz = self.table(sorted(cols)).transpose(numpy.argsort(order)).astype(float)
+        N_xz = N_xyz.sum(axis=1, keepdims=True)
+        N_yz = N_xyz.sum(axis=0, keepdims=True)
+        N_z = N_xz.sum(axis=0, keepdims=True)
+        observed = N_xyz > 0
+        G = 2 * (N_xyz * numpy.log(N_xyz * N_z / numpy.where(observed, N_xz * N_yz, 1), where=observed,
+                                   out=numpy.zeros_like(N_xyz))).sum()
+        levels = N_xyz.shape if self.levels is None else self.levels[cols]
+        dof = (levels[0] - 1) * (levels[1] - 1) * int(numpy.prod(levels[2:]))
+        return chdtrc(dof, G)
+
+
+class GaussianCITest(CITest):
+    """
+    Partial correlation t-test for continuous data (same statistic as bnsl.accessory.cor_test), computed from cached
+    sufficient statistics instead of rescanning the data. The rows of a test are determined by the partially observed
+    columns it involves, so the statistics are kept per such missingness pattern: the observed rows, the column sums
+    and the Gram matrix of the columns requested so far. A new column only adds one row and column to the Gram
+    matrix, computed from the data on the rows of the pattern, and a test reduces to inverting a small covariance
+    matrix. The cache is bounded by the total number of row indices and Gram matrix entries of the stored patterns.
+    """
+    name = 'cor_test'
+
+    def __init__(self, data, max_cells=10 ** 7):
+        """
+        @param data: data matrix, missing values are NaN
+        @param max_cells: maximum total number of row indices and Gram matrix entries of the cached statistics
+        """
+        # centring does not change the correlations but keeps the Gram matrices well conditioned
+        super().__init__(numpy.asarray(data, dtype=float) - numpy.nanmean(data, axis=0))
+        self.max_cells = max_cells
+        self.cells = 0
+        self.patterns = collections.OrderedDict()
+
+    def statistics(self, cols):
+        pattern = frozenset(self.index.incomplete.intersection(cols))
+        if pattern in self.patterns:
+            self.patterns.move_to_end(pattern)
+        else:
+            rows = self.rows(cols)
+            self.patterns[pattern] = {'rows': rows, 'cols': [], 'index': {}, 'sum': numpy.empty(0),
+                                      'gram': numpy.empty((0, 0))}
+            self.cells += len(rows)
+        stats = self.patterns[pattern]
+        new = [c for c in dict.fromkeys(cols) if c not in stats['index']]
+        if new:
+            # the data of the pattern are gathered for the new columns only, they are not kept
+            X_new = self.data[stats['rows'][:, None], new]
+            cross = self.data[numpy.ix_(stats['rows'], stats['cols'])].T @ X_new
+            self.cells -= stats['gram'].size
+            stats['gram'] = numpy.block([[stats['gram'], cross], [cross.T, X_new.T @ X_new]])
+            self.cells += stats['gram'].size
+            stats['sum'] = numpy.concatenate((stats['sum'], X_new.sum(axis=0)))
+            for c in new:
+                stats['index'][c] = len(stats['cols'])
+                stats['cols'].append(c)
+        while self.cells > self.max_cells and len(self.patterns) > 1:
+            evicted = self.patterns.popitem(last=False)[1]
+            self.cells -= len(evicted['rows']) + evicted['gram'].size
+        return stats
+
+    def __call__(self, cols):
+        stats = self.statistics(cols)
+        n = len(stats['rows'])
+        idx = [stats['index'][c] for c in cols]
+        s = stats['sum'][idx]
+        cov = (stats['gram'][numpy.ix_(idx, idx)] - numpy.outer(s, s) / n) / (n - 1)
+        precision = numpy.linalg.pinv(cov, hermitian=True)
+        r = -precision[0, 1] / numpy.sqrt(precision[0, 0] * precision[1, 1])
+        dof = n - len(cols)
+        if abs(r) >= 1:
+            return 0.0
+        return 2 * t.sf(abs(r) * numpy.sqrt(dof / (1 - r ** 2)), dof)
@@ -0,0 +1,375 @@
+import inspect
+import pickle
+
+import numpy
+import pandas
+
+from accessories import fit_rbf_features, gs_m, krr_iterative_imputation, krr_solve, rbf_features, rbf_kernel, \
+    ridge_solve, sq_dist, tune_krr
+from missforest import grow_forest, missforest, select_features
+
+
+def read_chunks(path, chunksize=10000):
+    """
+    @param path: CSV or Parquet (.parquet) file
+    @param chunksize: number of rows per chunk
+    @return: iterator over the rows of the file as data frames of at most chunksize rows
+    """
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        start = 0
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            chunk = batch.to_pandas()
+            # rows are numbered through the file as for CSV files
+            chunk.index = pandas.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            yield chunk
+    else:
+        yield from pandas.read_csv(path, chunksize=chunksize)
+
+
+def sample_rows(path, size, chunksize=10000, random_state=None):
+    """
+    uniform sample of the rows of a file read in chunks, so that at most size + chunksize rows are held in memory
+    @param path: CSV or Parquet (.parquet) file
+    @param size: number of sampled rows
+    @param chunksize: number of rows per chunk
+    @param random_state: seed of the sample
+    @return: sampled rows in the order of the file
+    """
+    rng = numpy.random.RandomState(random_state)
+    sample, keys = None, numpy.empty(0)
+    for chunk in read_chunks(path, chunksize):
+        sample = chunk if sample is None else pandas.concat((sample, chunk))
+        keys = numpy.concatenate((keys, rng.random_sample(len(chunk))))
+        # the rows with the size smallest random keys are a uniform sample of the rows read so far
+        if len(keys) > size:
+            keep = numpy.sort(numpy.argpartition(keys, size)[: size])
+            sample, keys = sample.iloc[keep], keys[keep]
+    return sample
+
+
+def fit_imputer(data, method='missforest', fs='mbfs', sample=None, threshold=0.1, max_tests=None, n_jobs=1,
+                random_state=None, **params):
+    """
+    fit the models imputing each variable from its selected features, which transform then applies to new data
+    @param data: training data that might contain missing values, e.g. the rows returned by sample_rows
+    @param method: 'missforest' for random forests or 'krr' for kernel ridge regression (continuous data only)
+    @param fs: feature selection method, 'mbfs' for MBFS (the partial pruning of krr_iterative_imputation for krr) or
+    'None' to use all other variables
+    @param sample: if not None, number of rows of data sampled to fit the models
+    @param threshold: threshold of conditional independence test
+    @param max_tests: maximum number of CI tests between a missingness indicator and a candidate cause in MBFS
+    @param n_jobs: number of parallel jobs of the feature selection and of the imputation of data, -1 for all cores
+    @param random_state: seed of the sample, of the imputation of data and of the models
+    @param params: parameters of missforest or krr_iterative_imputation, which imputes data before the models are
+    fitted on the observed rows of each variable
+    @return: fitted imputer
+    """
+    if method not in ['missforest', 'krr']:
+        raise Exception('Unknown imputation method: ' + method)
+    if fs not in ['mbfs', 'None']:
+        raise Exception('Unknown type of feature selection method: ' + fs)
+    rng = numpy.random.RandomState(random_state)
+    if sample is not None and sample < len(data):
+        data = data.iloc[numpy.sort(rng.choice(len(data), sample, replace=False))]
+    # string columns are categorical variables, completely missing variables cannot be imputed
+    data = data.apply(lambda x: x.astype('category') if x.dtype == object else x)
+    data = data.loc[:, data.notnull().any()]
+    varnames = list(data.columns)
+    levels = {var: data[var].cat.remove_unused_categories().cat.categories for var in varnames if
+              data[var].dtype == 'category'}
+    if method == 'krr' and len(levels) > 0:
+        raise Exception('KRR imputation of categorical variables is not supported.')
+    # variables are imputed in increasing order of their missing values in data
+    order = numpy.argsort(data.isnull().sum().to_numpy(), kind='stable').tolist()
+
+    features = {var: ([x for x in varnames if x != var], []) for var in varnames}
+    if fs == 'mbfs' and method == 'missforest':
+        features.update(select_features(data, varnames, threshold, max_tests, n_jobs))
+    elif fs == 'mbfs':
+        features.update({var: (mb, []) for var, mb in gs_m(data, varnames, threshold, n_jobs=n_jobs).items() if mb})
+    seed = rng.randint(numpy.iinfo(numpy.int32).max)
+    tuned = {}
+    if method == 'missforest':
+        data_imputed = missforest(data, n_jobs=n_jobs, features=features, random_state=seed, **params)[0]
+    else:
+        data_imputed = krr_iterative_imputation(data, prune='None', n_jobs=n_jobs, tuned=tuned, random_state=seed,
+                                                predictors={var: features[var][0] for var in varnames}, **params)
+    imputer = {'method': method, 'varnames': varnames, 'levels': levels, 'order': order, 'features': features,
+               'params': params, 'hyperparameters': tuned, 'fill': {}, 'models': {}}
+    # column indices of the features, variables of each type and codes of the levels, looked up by every imputation
+    imputer['inputs'] = [([varnames.index(x) for x in features[var][0]], [varnames.index(v) for v in features[var][1]])
+                         for var in varnames]
+    imputer['types'] = [[j for j, var in enumerate(varnames) if (var in levels) == factor] for factor in [False, True]]
+    imputer['codes'] = {var: {level: i for i, level in enumerate(levels[var])} for var in levels}
+    fit_models(imputer, data, data_imputed, rng.randint(numpy.iinfo(numpy.int32).max))
+    return imputer
+
+
+def fit_models(imputer, data, data_imputed, random_state=None):
+    """
+    fit the model of each variable of an imputer on its observed rows in data, with the features and the KRR
+    hyperparameters of the imputer. The hyperparameters of variables without any are tuned by tune_krr and stored
+    @param imputer: imputer returned by fit_imputer
+    @param data: data that might contain missing values
+    @param data_imputed: imputation of data
+    @param random_state: seed of the models
+    """
+    varnames, levels, params = imputer['varnames'], imputer['levels'], imputer['params']
+    rng = numpy.random.RandomState(random_state)
+    forest_params = {key: params[key] for key in params if key in inspect.signature(grow_forest).parameters}
+    tune_params = {key: params[key] for key in params if key in inspect.signature(tune_krr).parameters}
+    ximp = encode(data_imputed, varnames, levels)
+    observed = ~numpy.isnan(encode(data, varnames, levels))
+    for j, var in enumerate(varnames):
+        seed = rng.randint(numpy.iinfo(numpy.int32).max)
+        if not observed[:, j].any():
+            continue
+        if var in levels:
+            imputer['fill'][var] = numpy.bincount(ximp[observed[:, j], j].astype(int),
+                                                  minlength=len(levels[var])).argmax()
+        else:
+            imputer['fill'][var] = ximp[observed[:, j], j].mean()
+        x_cols, r_cols = imputer['inputs'][j]
+        X_obs = numpy.hstack((ximp[:, x_cols], ~observed[:, r_cols]))[observed[:, j]]
+        y_obs = ximp[observed[:, j], j]
+        if var in levels and len(numpy.unique(y_obs)) == 1:
+            imputer['models'][var] = y_obs[0]
+        elif imputer['method'] == 'missforest':
+            imputer['models'][var] = grow_forest(X_obs, y_obs, 'factor' if var in levels else 'numeric',
+                                                 random_state=seed, **forest_params)[0]
+        else:
+            if var not in imputer['hyperparameters']:
+                imputer['hyperparameters'][var] = tune_krr(X_obs, y_obs, X_obs[: 0], random_state=seed,
+                                                           **tune_params)[: 2]
+            sigma, lamda = imputer['hyperparameters'][var]
+            if params.get('approx') is None:
+                # only what predictions need is kept, not the factorization, so saved imputers stay small
+                imputer['models'][var] = {'X_train': X_obs, 'sigma': sigma, 'lamda': lamda,
+                                          'alpha': krr_solve(rbf_kernel(sq_dist(X_obs), sigma), y_obs, lamda)}
+            else:
+                feature_map = fit_rbf_features(X_obs, sigma, params['approx'], params.get('n_components', 100), seed)
+                imputer['models'][var] = {'feature_map': feature_map,
+                                          'weights': ridge_solve(rbf_features(X_obs, feature_map), y_obs, lamda)}
+    imputer['fill_values'] = numpy.array([imputer['fill'][var] for var in varnames], dtype=float)
+
+
+def encode(data, varnames, levels):
+    """
+    @return: numeric matrix of the variables varnames of data, categorical variables are coded by the index of their
+    value in levels and missing or unknown values are NaN
+    """
+    X = numpy.empty((len(data), len(varnames)))
+    for j, var in enumerate(varnames):
+        if var in levels:
+            codes = pandas.Categorical(data[var], categories=levels[var]).codes
+            X[:, j] = numpy.where(codes >= 0, codes, numpy.nan)
+        else:
+            X[:, j] = data[var].to_numpy(dtype=float)
+    return X
+
+
+def predict(model, X):
+    """
+    @return: predictions of a model fitted by fit_imputer for the features X
+    """
+    if isinstance(model, dict) and 'alpha' in model:
+        return rbf_kernel(sq_dist(X, model['X_train']), model['sigma']) @ model['alpha']
+    if isinstance(model, dict):
+        return rbf_features(X, model['feature_map']) @ model['weights']
+    if numpy.isscalar(model):
+        return numpy.full(len(X), model)
+    return model.predict(X)
+
+
+def impute_matrix(imputer, ximp, na_loc, maxiter=10, converge=True):
+    """
+    impute the missing cells of an encoded data matrix in place with the models of a fitted imputer, the models are
+    applied in sweeps over the variables until the imputation stops improving, as in missForest
+    @param imputer: imputer returned by fit_imputer
+    @param ximp: data matrix encoded as by encode, whose missing cells hold the initial imputation
+    @param na_loc: boolean matrix of the missing cells
+    @param maxiter: maximum number of sweeps
+    @param converge: if False, exactly maxiter sweeps are applied. The convergence check depends on all the rows of
+    ximp, without it every row is imputed independently of the others
+    @return: imputed data matrix
+    """
+    varnames = imputer['varnames']
+    todo = [j for j in imputer['order'] if na_loc[:, j].any()]
+    conv_new = numpy.zeros(2)
+    conv_old = numpy.full(2, numpy.inf)
+    ximp_old = ximp
+    iteration = 0
+    while ((conv_new < conv_old).any() or not converge) and iteration < maxiter:
+        if iteration != 0:
+            conv_old = conv_new.copy()
+        ximp_old = ximp.copy()
+        for j in todo:
+            x_cols, r_cols = imputer['inputs'][j]
+            rows = na_loc[:, j]
+            X = numpy.hstack((ximp[rows][:, x_cols], na_loc[rows][:, r_cols]))
+            ximp[rows, j] = predict(imputer['models'][varnames[j]], X)
+        iteration += 1
+        numeric, factor = imputer['types']
+        conv_new[0] = numpy.sum(numpy.square(ximp[:, numeric] - ximp_old[:, numeric])) / max(
+            numpy.sum(numpy.square(ximp[:, numeric])), numpy.finfo(float).tiny)
+        conv_new[1] = numpy.sum(ximp[:, factor] != ximp_old[:, factor]) / max(ximp[:, factor].size, 1)
+    return ximp if iteration == maxiter else ximp_old
+
+
+def transform(imputer, data, maxiter=10, converge=True):
+    """
+    impute the missing cells of data with the models of a fitted imputer
+    @param imputer: imputer returned by fit_imputer
+    @param data: data with the variables of the imputer, other columns are returned unchanged. Categorical values not
+    seen during fitting are imputed as missing values
+    @param maxiter: maximum number of sweeps
+    @param converge: if False, exactly maxiter sweeps are applied, see impute_matrix
+    @return: imputed data
+    """
+    varnames, levels = imputer['varnames'], imputer['levels']
+    if any(var not in data.columns for var in varnames):
+        raise Exception('Variable(s) ' + str([var for var in varnames if var not in data.columns]) + ' not found.')
+    ximp = encode(data, varnames, levels)
+    na_loc = numpy.isnan(ximp)
+    for j, var in enumerate(varnames):
+        ximp[na_loc[:, j], j] = imputer['fill'][var]
+    ximp = impute_matrix(imputer, ximp, na_loc, maxiter, converge)
+    data_imputed = data.copy()
+    for j, var in enumerate(varnames):
+        if var in levels:
+            data_imputed[var] = pandas.Categorical.from_codes(ximp[:, j].astype(int), levels[var])
+        else:
+            data_imputed[var] = ximp[:, j]
+    return data_imputed
+
+
+def impute_records(imputer, records, maxiter=10):
+    """
+    low-latency imputation of one record or a small batch of records, without building data frames
+    @param imputer: imputer returned by fit_imputer
+    @param records: dictionary of the values of the variables of one record, or list of such dictionaries. Missing
+    values are None, NaN or absent, unknown categorical values are imputed as missing values
+    @param maxiter: maximum number of sweeps
+    @return: imputed record(s), in the same form as records
+    """
+    batch = records if isinstance(records, list) else [records]
+    varnames, codes = imputer['varnames'], imputer['codes']
+    ximp = numpy.empty((len(batch), len(varnames)))
+    for i, record in enumerate(batch):
+        for j, var in enumerate(varnames):
+            value = record.get(var)
+            if var in codes:
+                ximp[i, j] = codes[var].get(value, numpy.nan)
+            else:
+                ximp[i, j] = numpy.nan if value is None else value
+    na_loc = numpy.isnan(ximp)
+    ximp[na_loc] = numpy.broadcast_to(imputer['fill_values'], ximp.shape)[na_loc]
+    ximp = impute_matrix(imputer, ximp, na_loc, maxiter)
+    imputed = []
+    for i, record in enumerate(batch):
+        record = dict(record)
+        for j in numpy.flatnonzero(na_loc[i]):
+            var = varnames[j]
+            record[var] = imputer['levels'][var][int(ximp[i, j])] if var in codes else float(ximp[i, j])
+        imputed.append(record)
+    return imputed if isinstance(records, list) else imputed[0]
+
+
+def transform_file(imputer, path, output, chunksize=10000, maxiter=10):
+    """
+    impute a CSV or Parquet file chunk by chunk, so that memory is bounded by the chunk size and the fitted models.
+    Every row is imputed by maxiter sweeps, without the convergence check of transform, so the imputation does not
+    depend on chunksize
+    @param imputer: imputer returned by fit_imputer
+    @param path: CSV or Parquet (.parquet) file to impute
+    @param output: CSV or Parquet (.parquet) file the imputed rows are written to
+    @param chunksize: number of rows imputed at a time
+    @param maxiter: number of sweeps of every row
+    @return: number of imputed rows
+    """
+    writer = None
+    n = 0
+    for chunk in read_chunks(path, chunksize):
+        data_imputed = transform(imputer, chunk, maxiter, converge=False)
+        if output.endswith('.parquet'):
+            import pyarrow
+            import pyarrow.parquet as pq
+            table = pyarrow.Table.from_pandas(data_imputed, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(output, table.schema)
+            writer.write_table(table)
+        else:
+            data_imputed.to_csv(output, mode='w' if n == 0 else 'a', header=n == 0, index=False)
+        n += len(chunk)
+    if writer is not None:
+        writer.close()
+    return n
+
+
+class MBFSImputer:
+    """
+    Imputer whose features, KRR hyperparameters and models are learned once by fit, and then impute new batches of
+    data with the same variables without structure learning or Bayesian Optimization. The fitted imputer is saved and
+    loaded with pickle, so only load files from trusted sources.
+    """
+
+    def __init__(self, method='missforest', fs='mbfs', threshold=0.1, max_tests=None, n_jobs=1, random_state=None,
+                 **params):
+        """
+        see fit_imputer for the parameters
+        """
+        self.method = method
+        self.fs = fs
+        self.threshold = threshold
+        self.max_tests = max_tests
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.params = params
+        self.state = None
+
+    def fit(self, data, sample=None):
+        """
+        @param data: training data that might contain missing values
+        @param sample: if not None, number of rows of data sampled to fit the models
+        """
+        self.state = fit_imputer(data, self.method, self.fs, sample, self.threshold, self.max_tests, self.n_jobs,
+                                 self.random_state, **self.params)
+        return self
+
+    def refit(self, data, maxiter=10):
+        """
+        refit the models on a new batch imputed by the current models, with the features and hyperparameters found by
+        fit
+        @param data: new batch that might contain missing values
+        @param maxiter: maximum number of sweeps of transform
+        """
+        fit_models(self.fitted(), data, transform(self.state, data, maxiter), self.random_state)
+        return self
+
+    def transform(self, data, maxiter=10):
+        return transform(self.fitted(), data, maxiter)
+
+    def transform_file(self, path, output, chunksize=10000, maxiter=10):
+        return transform_file(self.fitted(), path, output, chunksize, maxiter)
+
+    def impute(self, records, maxiter=10):
+        return impute_records(self.fitted(), records, maxiter)
+
+    def fitted(self):
+        if self.state is None:
+            raise Exception('The imputer is not fitted yet.')
+        return self.state
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            imputer = pickle.load(f)
+        if not isinstance(imputer, MBFSImputer):
+            raise Exception(path + ' is not a saved MBFSImputer.')
+        return imputer
@@ -2,18 +2,10 @@ import argparse
 import random
 
 import pandas
-import rpy2.robjects as ro
-from bnsl import ges, f1, add_missing, from_bnlearn
-from rpy2.robjects import pandas2ri
-from rpy2.robjects.packages import importr
-
-pandas2ri.activate()
+from bnsl import ges, f1, add_missing
 
 from accessories import rmse
-
-base, bnlearn = importr('base'), importr('bnlearn')
-ro.r('''source('missForest.r')''')
-missForest = ro.globalenv['missForest']
+from missforest import missforest
 
 
 # create missing mechanism
@@ -53,9 +45,17 @@ def main(args):
         ratio_of_partially_observed_variables: proportion of missing values
         error_rate: maximum error rate
         feature_selection: feature selection approach ('None' or 'mbfs')
+        backend: implementation of missForest ('python' or 'R')
     :return:
         data_imputed: imputed data
     '''
+    if args.data_type == 'synthetic' or args.backend == 'R':
+        # R is only needed to sample synthetic data and to run the original missForest.R
+        import rpy2.robjects as ro
+        from rpy2.robjects import pandas2ri
+        from rpy2.robjects.packages import importr
+        pandas2ri.activate()
+        base, bnlearn = importr('base'), importr('bnlearn')
     if args.data_type == 'synthetic':
         model = base.readRDS('model/' + args.data_name + '.rds')
         data_clean = ro.conversion.rpy2py(bnlearn.rbn(model, args.data_size))
@@ -67,13 +67,21 @@ def main(args):
     data_missing = add_missing(data_clean, miss_mechanism(list(data_clean.columns), args.missing_type,
                                                           args.ratio_of_partially_observed_variables),
                                m_max=args.error_rate)
-    data_imputed = ro.conversion.rpy2py(missForest(ro.conversion.py2rpy(data_missing), fs=args.feature_selection)[0])
+    if args.backend == 'python':
+        data_imputed = missforest(data_missing, fs=args.feature_selection)[0]
+    elif args.backend == 'R':
+        ro.r('''source('missForest.r')''')
+        data_imputed = ro.conversion.rpy2py(
+            ro.globalenv['missForest'](ro.conversion.py2rpy(data_missing), fs=args.feature_selection)[0])
+    else:
+        raise Exception('Unknown backend:', args.backend, '. Should be either \'python\' or \'R\' ')
 
     print('data:', args.data_name)
     print('data size:', args.data_size)
     print('missing type:', args.missing_type)
     print('error rate', args.error_rate)
     print('feature selection:', args.feature_selection)
+    print('backend:', args.backend)
     print('RMSE:', rmse(data_clean, data_imputed, data_missing))
     if args.data_type == 'synthetic':
         print('F1:', f1(bnlearn.modelstring(model)[0], ges(data_imputed)))
@@ -119,6 +127,12 @@ if __name__ == '__main__':
         choices=['None', 'mbfs'],
         default='mbfs',
         type=str)
+    parser.add_argument(
+        '--backend',
+        help='implementation of missForest, the native python one or the original R script',
+        choices=['python', 'R'],
+        default='python',
+        type=str)
     args = parser.parse_args()
 
     # Calls main function
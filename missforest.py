@@ -0,0 +1,424 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import combinations
+
+import numpy
+import pandas
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+
+from accessories import gs_m
+from ci_cache import MemoryCache, ci_key, column_digests
+from ci_tests import GaussianCITest, GTest
+
+
+def find_causes(data, var_missing, threshold=0.1, max_tests=None, n_jobs=1, timing=None, ci_cache=None):
+    """
+    find the causes of missingness indicators
+    @param data: input data that might contain missing values
+    @param var_missing: names of the variables with missing values
+    @param threshold: threshold of conditional independence test
+    @param max_tests: maximum number of CI tests between an indicator and a candidate cause over all conditioning
+    sets, unbounded if None
+    @param n_jobs: number of processes searching the causes of different indicators, -1 for all cores
+    @param timing: dictionary filled with the search time in seconds of each variable in var_missing, if not None
+    @param ci_cache: cache of conditional independence test results (see ci_cache.py), a new MemoryCache if None.
+    Parallel workers use their own MemoryCache instead
+    @return: dictionary of the causes of the missingness indicator of each variable in var_missing
+    """
+    if n_jobs != 1 and len(var_missing) > 1:
+        n_jobs = min(n_jobs if n_jobs > 0 else os.cpu_count(), len(var_missing))
+        # every worker takes a strided share of the variables, the results are merged in the order of var_missing
+        with ProcessPoolExecutor(n_jobs) as executor:
+            results = list(executor.map(find_causes_timed, [data] * n_jobs,
+                                        [var_missing[i::n_jobs] for i in range(n_jobs)], [threshold] * n_jobs,
+                                        [max_tests] * n_jobs))
+        causes, times = {}, {}
+        for result in results:
+            causes.update(result[0])
+            times.update(result[1])
+        if timing is not None:
+            timing.update({var: times[var] for var in var_missing})
+        return {var: causes[var] for var in var_missing}
+    varnames = list(data.columns)
+    p = len(varnames)
+    indicators = data[var_missing].isnull().to_numpy()
+    if all(data.dtypes == 'category'):
+        codes = data.apply(lambda x: x.cat.codes).to_numpy()
+        # the degrees of freedom count the levels observed in each column, as ci.test of bnlearn on the droplevels data
+        # of find.causes in missForest.R, and both levels of the indicators
+        levels = [len(numpy.unique(codes[codes[:, i] >= 0, i])) for i in range(p)] + [2] * len(var_missing)
+        ci_test = GTest(numpy.hstack((codes, indicators)), levels)
+    elif all(data.dtypes != 'category'):
+        ci_test = GaussianCITest(numpy.hstack((data.to_numpy(dtype=float), indicators)))
+    else:
+        raise Exception('Mixed type of data is not supported.')
+    if ci_cache is None:
+        ci_cache = MemoryCache()
+    # the indicators are named as in missForest.R, the digests keep them apart from the variables
+    names = varnames + ['is.na(' + str(var) + ')' for var in var_missing]
+    digests = column_digests(ci_test.data, names)
+
+    def test(cols):
+        key = ci_key(ci_test.name, [names[c] for c in cols], digests, ci_test.index.words(cols))
+        p_value = ci_cache.get(key)
+        if p_value is None:
+            p_value = ci_test(cols)
+            ci_cache.set(key, p_value)
+        return p_value
+
+    def varying(r, cols):
+        # whether the missingness indicator r takes both values on the complete cases of cols
+        observed = indicators[ci_test.rows(cols), r]
+        return observed.any() and not observed.all()
+
+    causes = {}
+    for r, var in enumerate(var_missing):
+        start = time.perf_counter()
+        causes[var] = [i for i in range(p) if varnames[i] != var]
+        # p value of the marginal test of each candidate, the conditioning sets favour strongly associated candidates
+        assoc = numpy.ones(p)
+        tests = numpy.zeros(p, dtype=int)
+        l = 0
+        while len(causes[var]) > l:
+            remaining = list(causes[var])
+            pool = sorted(remaining, key=lambda c: assoc[c])
+            for can in remaining:
+                if not varying(r, [can]):
+                    continue
+                # conditioning sets are enumerated lazily, in lexicographic order of the association ranks
+                for con in combinations([c for c in pool if c != can], l):
+                    if max_tests is not None and tests[can] >= max_tests:
+                        break
+                    if varying(r, [can] + list(con)):
+                        tests[can] += 1
+                        p_value = test([p + r, can] + list(con))
+                        if l == 0:
+                            assoc[can] = p_value
+                        if p_value > threshold:
+                            causes[var].remove(can)
+                            break
+            l += 1
+            if l > 5:
+                break
+        causes[var] = [varnames[i] for i in causes[var]]
+        if timing is not None:
+            timing[var] = time.perf_counter() - start
+    return causes
+
+
+def find_causes_timed(data, var_missing, threshold=0.1, max_tests=None):
+    """
+    @return: causes of the missingness indicators found by find_causes and the search time of each variable
+    """
+    timing = {}
+    return find_causes(data, var_missing, threshold, max_tests, timing=timing), timing
+
+
+def select_features(data, targets, threshold=0.1, max_tests=None, n_jobs=1, timing=None, ci_cache=None):
+    """
+    Markov blanket-based feature selection
+    @param data: input data that might contain missing values
+    @param targets: names of the variables whose features are selected
+    @param threshold: threshold of conditional independence test
+    @param max_tests: maximum number of CI tests between a missingness indicator and a candidate cause
+    @param n_jobs: number of processes searching the Markov blankets and the causes of missingness, -1 for all cores
+    @param timing: dictionary filled with the search time in seconds of each variable in targets, if not None
+    @param ci_cache: cache of conditional independence test results shared by the searches, a new MemoryCache if None
+    @return: dictionary of the features of each variable in targets with a nonempty selection, as the names of the
+    variables and the names of the variables whose missingness indicators are used
+    """
+    var_missing = [var for var in data.columns if data[var].isnull().any()]
+    mb_time, cause_time = {}, {}
+    if ci_cache is None:
+        ci_cache = MemoryCache()
+    mb_o = gs_m(data, targets, threshold, ci_cache, n_jobs, mb_time)
+    cause_list = find_causes(data, var_missing, threshold, max_tests, n_jobs, cause_time, ci_cache)
+    if timing is not None:
+        timing.update({var: mb_time[var] + cause_time.get(var, 0) for var in targets})
+    features = {}
+    for var in targets:
+        # the intrinsic MB and the variables sharing a missingness indicator with var, plus these indicators
+        mb_x_v = list(mb_o[var])
+        mb_x_r = []
+        for v in var_missing:
+            if var in cause_list[v]:
+                mb_x_r.append(v)
+                mb_x_v += [x for x in cause_list[v] if x != var and x not in mb_x_v]
+        if len(mb_x_v) + len(mb_x_r) != 0:
+            features[var] = (mb_x_v, mb_x_r)
+    return features
+
+
+def forest_oob_error(forest, y_obs):
+    """
+    @return: out-of-bag mean squared error or proportion of falsely classified entries of a fitted forest
+    """
+    # rows in the bag of every tree have no out-of-bag votes (NaN, or all zero votes for a classifier) and are ignored
+    if isinstance(forest, RandomForestRegressor):
+        return numpy.nanmean(numpy.square(forest.oob_prediction_ - y_obs))
+    votes = numpy.nan_to_num(forest.oob_decision_function_)
+    voted = votes.sum(axis=1) > 0
+    return numpy.mean(forest.classes_[votes[voted].argmax(axis=1)] != numpy.asarray(y_obs)[voted])
+
+
+def impute_forest(X_obs, y_obs, X_mis, var_type, ntree=100, nodesize=None, maxnodes=None, n_jobs=1,
+                  random_state=None, forest=None, refresh=0.25, ntree_batch=25, ntree_tol=None):
+    """
+    fit a random forest on the observed part of a variable and predict its missing part
+    @param X_obs: features of the observed rows
+    @param y_obs: observed values of the variable, integer-coded if categorical
+    @param X_mis: features of the missing rows
+    @param var_type: 'numeric' or 'factor'
+    @param ntree: how many trees are grown in the forest
+    @param nodesize: minimum size of terminal nodes for continuous and categorical variables
+    @param maxnodes: maximum number of terminal nodes for individual trees
+    @param n_jobs: number of jobs to grow the trees in parallel
+    @param random_state: seed of the forest
+    @param forest: forest of the variable from the previous iteration to warm-start from, whose oldest refresh share
+    of trees is replaced by trees fitted on the current imputation. A new forest is grown if None
+    @param refresh: share of the trees of forest refitted
+    @param ntree_batch: number of trees added at a time if ntree_tol is set
+    @param ntree_tol: if not None, trees are added ntree_batch at a time until the relative change of the out-of-bag
+    error is at most ntree_tol or there are ntree trees
+    @return: predictions of the missing values, the out-of-bag error, the forest and the number of trees fitted
+    """
+    if var_type == 'factor' and len(numpy.unique(y_obs)) == 1:
+        return numpy.full(len(X_mis), y_obs[0]), 0, None, 0
+    if forest is not None:
+        n_new = max(1, round(refresh * len(forest.estimators_)))
+        del forest.estimators_[: n_new]
+        # a new seed, the seeds of the new trees would otherwise repeat those of kept trees
+        forest.set_params(n_estimators=len(forest.estimators_) + n_new, n_jobs=n_jobs, random_state=random_state)
+        forest.fit(X_obs, y_obs)
+        return forest.predict(X_mis), forest_oob_error(forest, y_obs), forest, n_new
+    forest, error = grow_forest(X_obs, y_obs, var_type, ntree, nodesize, maxnodes, n_jobs, random_state, ntree_batch,
+                                ntree_tol)
+    return forest.predict(X_mis), error, forest, forest.n_estimators
+
+
+def grow_forest(X_obs, y_obs, var_type, ntree=100, nodesize=None, maxnodes=None, n_jobs=1, random_state=None,
+                ntree_batch=25, ntree_tol=None):
+    """
+    fit a random forest on the observed part of a variable
+    @return: the forest and its out-of-bag error
+    see impute_forest for the parameters
+    """
+    params = dict(n_estimators=ntree if ntree_tol is None else min(ntree_batch, ntree),
+                  max_features=min(X_obs.shape[1], int(numpy.sqrt(X_obs.shape[1] + 1))), max_leaf_nodes=maxnodes,
+                  oob_score=True, warm_start=True, n_jobs=n_jobs, random_state=random_state)
+    if var_type == 'numeric':
+        forest = RandomForestRegressor(min_samples_leaf=nodesize[0] if nodesize is not None else 1, **params)
+    else:
+        forest = RandomForestClassifier(min_samples_leaf=nodesize[1] if nodesize is not None else 5, **params)
+    forest.fit(X_obs, y_obs)
+    error = forest_oob_error(forest, y_obs)
+    while ntree_tol is not None and forest.n_estimators < ntree:
+        forest.set_params(n_estimators=min(forest.n_estimators + ntree_batch, ntree))
+        forest.fit(X_obs, y_obs)
+        previous, error = error, forest_oob_error(forest, y_obs)
+        if abs(previous - error) <= ntree_tol * error:
+            break
+    return forest, error
+
+
+def missforest(data, maxiter=10, ntree=100, variablewise=False, decreasing=False, verbose=False, nodesize=None,
+               maxnodes=None, fs='mbfs', threshold=0.1, max_tests=None, parallelize='no', n_jobs=1,
+               warm_start=False, refresh=0.25, ntree_batch=25, ntree_tol=None, trajectory=None, features=None,
+               random_state=None):
+    """
+    missForest imputation with optional Markov blanket-based feature selection (MBFS), a Python port of missForest.R
+    @param data: input data that might contain missing values, categorical variables must have the category dtype
+    @param maxiter: stop after how many iterations
+    @param ntree: how many trees are grown in the forest
+    @param variablewise: whether to return OOB errors for each variable separately
+    @param decreasing: if True the columns are sorted with decreasing amount of missing values
+    @param verbose: whether to print error estimates, differences and runtime of each iteration
+    @param nodesize: minimum size of terminal nodes, tuple of length 2, with the number for continuous variables in the
+    first entry and the number for categorical variables in the second entry
+    @param maxnodes: maximum number of terminal nodes for individual trees
+    @param fs: feature selection method, 'mbfs' for MF+MBFS or 'None' for the normal MF algorithm
+    @param threshold: threshold for p value used in MBFS
+    @param max_tests: maximum number of CI tests between a missingness indicator and a candidate cause in MBFS
+    @param parallelize: 'no' for a single process, 'forests' to grow the trees of each forest in parallel or
+    'variables' to fit the forests of n_jobs variables in parallel, each on the imputation of the previous n_jobs
+    @param n_jobs: number of parallel jobs, -1 for all cores, which also search the Markov blankets and the causes of
+    missingness of different variables in parallel unless parallelize is 'no'
+    @param warm_start: if True the forest of each variable is kept across iterations and only its oldest refresh share
+    of trees is refitted
+    @param refresh: share of the trees refitted per iteration by warm_start
+    @param ntree_batch: number of trees added at a time if ntree_tol is set
+    @param ntree_tol: if not None, trees are added ntree_batch at a time until the relative change of the OOB error is
+    at most ntree_tol, ntree is then the maximum number of trees
+    @param trajectory: if not None, directory where the imputed values of the missing cells (in row-major order,
+    categories as integer codes) are saved after every iteration as iteration_<iteration>.npy, only the current and
+    previous imputations are kept in memory
+    @param features: features of the variables as returned by select_features, which replace the feature selection,
+    variables without features are imputed from all other variables
+    @param random_state: seed of the random forests
+    @return: imputed data and the estimated OOB imputation error
+    """
+    if fs not in ['mbfs', 'None']:
+        raise Exception('Unknown type of feature selection method: ' + fs)
+    if parallelize not in ['no', 'variables', 'forests']:
+        raise Exception('Unknown type of parallelization: ' + parallelize)
+    if nodesize is not None and len(nodesize) != 2:
+        raise Exception('nodesize should have length 2.')
+    if n_jobs < 1:
+        n_jobs = os.cpu_count()
+    # string columns are categorical variables
+    data = data.apply(lambda x: x.astype('category') if x.dtype == object else x)
+    n, p = data.shape
+    # remove completely missing variables
+    if any(data.isnull().sum() == n):
+        print('  removed variable(s)', list(data.columns[data.isnull().sum() == n]),
+              'due to the missingness of all entries')
+        data = data.loc[:, data.isnull().sum() < n].copy()
+        p = data.shape[1]
+    varnames = list(data.columns)
+    var_type = ['factor' if data[var].dtype == 'category' else 'numeric' for var in varnames]
+    rng = numpy.random.RandomState(random_state)
+
+    # perform initial S.W.A.G. on data (mean imputation), categorical variables are integer-coded
+    ximp = numpy.empty((n, p))
+    levels = {}
+    for j, var in enumerate(varnames):
+        if var_type[j] == 'numeric':
+            ximp[:, j] = data[var].fillna(data[var].mean()).to_numpy(dtype=float)
+        else:
+            data[var] = data[var].cat.remove_unused_categories()
+            levels[var] = data[var].cat.categories
+            codes = data[var].cat.codes.to_numpy()
+            counts = numpy.bincount(codes[codes >= 0], minlength=len(levels[var]))
+            # take the level which is more 'likely' (majority vote), ties are broken at random
+            ximp[:, j] = numpy.where(codes >= 0, codes, rng.choice(numpy.flatnonzero(counts == counts.max())))
+
+    # extract missingness pattern
+    na_loc = data.isnull().to_numpy()
+    no_na_var = na_loc.sum(axis=0)
+    sort_j = numpy.argsort(no_na_var, kind='stable')
+    if decreasing:
+        sort_j = sort_j[::-1]
+
+    # features of each variable, as the columns of ximp and the missingness indicators used
+    predictors = {}
+    for j in range(p):
+        if no_na_var[j] != 0:
+            predictors[j] = ([i for i in range(p) if i != j], [])
+    if features is not None:
+        for var in [var for var in features if var in varnames and no_na_var[varnames.index(var)] != 0]:
+            predictors[varnames.index(var)] = ([varnames.index(x) for x in features[var][0]],
+                                               [varnames.index(v) for v in features[var][1]])
+    elif fs == 'mbfs':
+        var_missing = [varnames[j] for j in range(p) if no_na_var[j] > 0]
+        mbfs_time = {}
+        ci_cache = MemoryCache()
+        selected = select_features(data, var_missing, threshold, max_tests, n_jobs if parallelize != 'no' else 1,
+                                   mbfs_time, ci_cache)
+        if verbose:
+            print('  MBFS time per variable (seconds):')
+            for var in var_missing:
+                print('    ' + str(var) + ':', mbfs_time[var])
+            if ci_cache.hits + ci_cache.misses > 0:
+                print('  CI tests of MBFS:', ci_cache.misses, 'computed,', ci_cache.hits, 'cached (hit rate %.1f%%)' % (
+                    100 * ci_cache.hits / (ci_cache.hits + ci_cache.misses)))
+        for var in selected:
+            predictors[varnames.index(var)] = ([varnames.index(x) for x in selected[var][0]],
+                                               [varnames.index(v) for v in selected[var][1]])
+
+    # initialize parameters of interest
+    iteration = 0
+    types = [t for t in ['numeric', 'factor'] if t in var_type]
+    conv_new = numpy.zeros(len(types))
+    conv_old = numpy.full(len(types), numpy.inf)
+    oob_error = numpy.zeros(p)
+    oob_err = oob_err_old = None
+    ximp_old = ximp
+    todo = [j for j in sort_j if no_na_var[j] != 0]
+    forest_params = dict(ntree=ntree, nodesize=nodesize, maxnodes=maxnodes, refresh=refresh, ntree_batch=ntree_batch,
+                         ntree_tol=ntree_tol)
+    # forests of each variable kept across the iterations by warm_start
+    forests = {}
+
+    def forest_inputs(j):
+        x_cols, r_cols = predictors[j]
+        X = numpy.hstack((ximp[:, x_cols], na_loc[:, r_cols]))
+        return X[~na_loc[:, j]], ximp[~na_loc[:, j], j], X[na_loc[:, j]], var_type[j]
+
+    def stop_criterion():
+        return (conv_new < conv_old).any() and iteration < maxiter
+
+    if trajectory is not None:
+        os.makedirs(trajectory, exist_ok=True)
+
+    # iterate missForest
+    with ProcessPoolExecutor(n_jobs) if parallelize == 'variables' else nullcontext() as executor:
+        while stop_criterion():
+            if iteration != 0:
+                conv_old = conv_new.copy()
+                oob_err_old = oob_err
+            if verbose:
+                print('  missForest iteration', iteration + 1, 'in progress...', end='')
+            t_start = time.time()
+            ximp_old = ximp.copy()
+            seeds = {j: rng.randint(numpy.iinfo(numpy.int32).max) for j in todo}
+            fitted = {}
+            if parallelize == 'variables':
+                # the variables of a chunk are fitted in parallel on the imputation left by the previous chunks
+                for chunk in [todo[i:i + n_jobs] for i in range(0, len(todo), n_jobs)]:
+                    futures = {j: executor.submit(impute_forest, *forest_inputs(j), random_state=seeds[j],
+                                                  forest=forests.get(j), **forest_params) for j in chunk}
+                    for j in chunk:
+                        ximp[na_loc[:, j], j], oob_error[j], forest, fitted[j] = futures[j].result()
+                        if warm_start:
+                            forests[j] = forest
+            else:
+                for j in todo:
+                    ximp[na_loc[:, j], j], oob_error[j], forest, fitted[j] = impute_forest(
+                        *forest_inputs(j), random_state=seeds[j], n_jobs=n_jobs if parallelize == 'forests' else 1,
+                        forest=forests.get(j), **forest_params)
+                    if warm_start:
+                        forests[j] = forest
+            if verbose:
+                print('done!')
+                print('    trees fitted:', sum(fitted.values()))
+            iteration += 1
+            if trajectory is not None:
+                numpy.save(os.path.join(trajectory, 'iteration_%02d.npy' % iteration), ximp[na_loc])
+
+            # check the difference between iteration steps
+            for t, t_type in enumerate(types):
+                t_ind = [j for j in range(p) if var_type[j] == t_type]
+                if t_type == 'numeric':
+                    conv_new[t] = numpy.sum(numpy.square(ximp[:, t_ind] - ximp_old[:, t_ind])) / numpy.sum(
+                        numpy.square(ximp[:, t_ind]))
+                else:
+                    conv_new[t] = numpy.sum(ximp[:, t_ind] != ximp_old[:, t_ind]) / (n * len(t_ind))
+
+            # compute estimated imputation error
+            if not variablewise:
+                oob_err = {}
+                if 'numeric' in types:
+                    numeric = [var for var, t in zip(varnames, var_type) if t == 'numeric']
+                    oob_err['NRMSE'] = numpy.sqrt(
+                        numpy.mean(oob_error[[t == 'numeric' for t in var_type]]) / numpy.nanvar(
+                            data[numeric].to_numpy(dtype=float), ddof=1))
+                if 'factor' in types:
+                    oob_err['PFC'] = numpy.mean(oob_error[[t == 'factor' for t in var_type]])
+            else:
+                oob_err = {var: oob_error[j] for j, var in enumerate(varnames)}
+
+            # return status output, if desired
+            if verbose:
+                print('    estimated error(s):', oob_err)
+                print('    difference(s):', conv_new)
+                print('    time:', time.time() - t_start, 'seconds\n')
+
+    # produce output w.r.t. stopping rule
+    if iteration != maxiter:
+        ximp, oob_err = ximp_old, oob_err_old
+    data_imputed = pandas.DataFrame(ximp, columns=varnames, index=data.index)
+    for var in levels:
+        data_imputed[var] = pandas.Categorical.from_codes(ximp[:, varnames.index(var)].astype(int), levels[var])
+    return data_imputed, oob_err
@@ -0,0 +1,158 @@
+"""
+Storage of the data sets and imputed data of the experiments. A data set is addressed by its path without extension
+(stem) and stored as CSV or in a columnar binary format which keeps the dtypes, including categorical columns:
+- 'npy': directory of one .npy file per column, categorical and string columns as integer codes, read with memory
+  mapping
+- 'feather' and 'parquet': Arrow files (requires pyarrow), feather files are read with memory mapping
+A data set is loaded once per process, and a CSV file is converted to the columnar format on its first read.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import numpy
+import pandas
+
+formats = {'csv': '.csv', 'npy': '.npy', 'feather': '.feather', 'parquet': '.parquet'}
+# data sets loaded by this process, with the modification time of their file
+loaded = {}
+
+
+def dataset_path(stem, fmt='csv'):
+    return stem + formats[fmt]
+
+
+def find_format(stem):
+    """
+    @return: the format the data set is stored in, preferring the columnar ones, None if it does not exist
+    """
+    for fmt in ['npy', 'feather', 'parquet', 'csv']:
+        if os.path.exists(dataset_path(stem, fmt)):
+            return fmt
+    return None
+
+
+def content_hash(path):
+    """
+    @return: hash of the content of a file, or of the files of a directory
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    files = [path] if os.path.isfile(path) else [os.path.join(path, name) for name in sorted(os.listdir(path))]
+    for file in files:
+        digest.update(os.path.basename(file).encode() + b'\0')
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def write_dataset(data, stem, fmt='csv'):
+    """
+    @param data: data frame
+    @param stem: path of the data set without extension
+    @param fmt: storage format in formats
+    @return: path of the stored data set
+    """
+    path = dataset_path(stem, fmt)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    # written next to the target and then moved in place, so that readers never see a partial data set
+    temp = path + '.tmp'
+    if fmt == 'csv':
+        data.to_csv(temp, index=False)
+    elif fmt == 'npy':
+        os.makedirs(temp, exist_ok=True)
+        columns = []
+        for i, var in enumerate(data.columns):
+            column = data[var]
+            if column.dtype == 'category':
+                numpy.save(os.path.join(temp, str(i) + '.npy'), column.cat.codes.to_numpy())
+                columns.append({'name': var, 'dtype': 'category', 'categories': column.cat.categories.tolist(),
+                                'ordered': bool(column.cat.ordered)})
+            elif column.dtype == object:
+                # python objects can not be memory mapped, the values are stored once and indexed by codes
+                codes, values = pandas.factorize(column)
+                numpy.save(os.path.join(temp, str(i) + '.npy'), codes)
+                columns.append({'name': var, 'dtype': 'object', 'categories': values.tolist()})
+            else:
+                numpy.save(os.path.join(temp, str(i) + '.npy'), column.to_numpy())
+                columns.append({'name': var, 'dtype': str(column.dtype)})
+        with open(os.path.join(temp, 'columns.json'), 'w') as f:
+            json.dump(columns, f)
+    elif fmt == 'feather':
+        data.reset_index(drop=True).to_feather(temp)
+    elif fmt == 'parquet':
+        data.to_parquet(temp, index=False)
+    else:
+        raise Exception('Unknown data format: ' + fmt)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(temp, path)
+    return path
+
+
+def read_npy(path):
+    with open(os.path.join(path, 'columns.json')) as f:
+        columns = json.load(f)
+    data = {}
+    for i, column in enumerate(columns):
+        values = numpy.load(os.path.join(path, str(i) + '.npy'), mmap_mode='r', allow_pickle=False)
+        if column['dtype'] == 'category':
+            data[column['name']] = pandas.Categorical.from_codes(values, column['categories'], column['ordered'])
+        elif column['dtype'] == 'object':
+            data[column['name']] = numpy.asarray(pandas.Categorical.from_codes(values, column['categories']),
+                                                 dtype=object)
+        else:
+            data[column['name']] = values
+    return pandas.DataFrame(data, copy=False)
+
+
+def has_dtype(column, dtype):
+    """
+    @return: whether column has dtype, any categorical column has the dtype 'category'
+    """
+    dtype = pandas.api.types.pandas_dtype(dtype)
+    if isinstance(dtype, pandas.CategoricalDtype) and dtype.categories is None:
+        return isinstance(column.dtype, pandas.CategoricalDtype)
+    return column.dtype == dtype
+
+
+def read_dataset(stem, fmt=None, dtype=None):
+    """
+    load a data set once per process, the returned data frame is shared and should not be modified
+    @param stem: path of the data set without extension
+    @param fmt: columnar format a CSV data set is converted to on its first read, None to read the stored format
+    @param dtype: dtype of the columns, e.g. 'category', or dictionary of the dtype of each column. A columnar format
+    keeps the dtypes of the read which converted it, the columns stored with another dtype are converted from their
+    stored values
+    @return: data frame
+    """
+    stored = find_format(stem)
+    if stored is None:
+        raise Exception('Data set ' + stem + ' not found.')
+    if stored == 'csv' and fmt not in [None, 'csv']:
+        write_dataset(pandas.read_csv(dataset_path(stem), dtype=dtype), stem, fmt)
+        stored = fmt
+    path = dataset_path(stem, stored)
+    # a dtype per column is given as a dictionary, which is not hashable
+    key = (os.path.abspath(stem), tuple(sorted(dtype.items(), key=str)) if isinstance(dtype, dict) else str(dtype))
+    if key in loaded and loaded[key][0] == os.stat(path).st_mtime_ns:
+        return loaded[key][1]
+    if stored == 'csv':
+        data = pandas.read_csv(path, dtype=dtype)
+    elif stored == 'npy':
+        data = read_npy(path)
+    elif stored == 'feather':
+        import pyarrow.feather
+        data = pyarrow.feather.read_table(path, memory_map=True).to_pandas()
+    else:
+        data = pandas.read_parquet(path)
+    if stored != 'csv' and dtype is not None:
+        dtypes = dtype if isinstance(dtype, dict) else dict.fromkeys(data.columns, dtype)
+        converted = {var: dtypes[var] for var in data.columns
+                     if var in dtypes and not has_dtype(data[var], dtypes[var])}
+        if converted:
+            data = data.astype(converted)
+    loaded[key] = (os.stat(path).st_mtime_ns, data)
+    return data
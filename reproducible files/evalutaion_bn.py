@@ -1,8 +1,12 @@
+import argparse
+
 import pandas
-from bnsl import from_bnlearn, f1, ges
+from bnsl import from_bnlearn, f1
 from rpy2.robjects.packages import importr
 
 from accessories import rmse
+from data_io import read_dataset
+from ges_cache import learn_all
 
 base, bnlearn = importr('base'), importr('bnlearn')
 
@@ -13,26 +17,49 @@ datasize_list = [500, 1000, 2000, 3000]
 algorithm_list = ['Mean', 'KNN', 'GAIN', 'softImpute', 'MF', 'MBMF']
 result_path = '../results_bn.csv'
 columns = ['model', 'datasize', 'missingtype', 'missingrate', 'algorithm', 'rmse', 'F1']
-result = pandas.DataFrame(columns=columns)
-result_list = result.values.tolist()
-
-for model in model_list:
-    dag = from_bnlearn(bnlearn.modelstring(base.readRDS('../model/' + model + '.rds'))[0])
-    for datasize in datasize_list:
-        data = pandas.read_csv('../data/' + model + '/Complete.csv')
-        result_list.append([model, datasize, 'Complete', 0, None, 0, f1(dag, ges(data.head(datasize)))])
-        print(result_list[-1])
-        for missing_type in missing_type_list:
-            for missing_rate in missing_rate_list:
-                data_missing = pandas.read_csv(
-                    '../data/' + model + '/' + missing_type + '_' + str(missing_rate) + '.csv')
-                for algorithm in algorithm_list:
-                    data_impute = pandas.read_csv(
-                        '../imputed_data/' + model + '/' + missing_type + '_' + str(missing_rate) + '_' + str(
-                            datasize) + '_' + algorithm + '.csv')
-                    result_list.append([model, datasize, missing_type, missing_rate, algorithm,
-                                        rmse(data.head(datasize), data_impute, data_missing.head(datasize)),
-                                        f1(dag, ges(data_impute))])
-                    print(result_list[-1])
-
-pandas.DataFrame(result_list, columns=columns).to_csv(result_path, index=False)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_jobs', help='number of processes running GES, -1 for all cores', default=-1, type=int)
+    parser.add_argument('--cache_dir', help='directory of the cached GES results', default='../ges_cache', type=str)
+    args = parser.parse_args()
+
+    # the DAGs of all rows of the results are learned up front in parallel, those of unchanged files are cached
+    cells = []
+    for model in model_list:
+        for datasize in datasize_list:
+            cells.append([model, datasize, 'Complete', 0, None])
+            for missing_type in missing_type_list:
+                for missing_rate in missing_rate_list:
+                    for algorithm in algorithm_list:
+                        cells.append([model, datasize, missing_type, missing_rate, algorithm])
+
+    # the data sets are read in the format they are stored in, see data_io.py
+    def imputed_stem(model, datasize, missing_type, missing_rate, algorithm):
+        return '../imputed_data/' + model + '/' + missing_type + '_' + str(missing_rate) + '_' + str(
+            datasize) + '_' + algorithm
+
+    dags = learn_all([('../data/' + cell[0] + '/Complete', cell[1]) if cell[4] is None else (
+        imputed_stem(*cell), None) for cell in cells], args.n_jobs, args.cache_dir)
+
+    result_list = []
+    for model in model_list:
+        dag = from_bnlearn(bnlearn.modelstring(base.readRDS('../model/' + model + '.rds'))[0])
+        data = read_dataset('../data/' + model + '/Complete')
+        data_missing = {(missing_type, missing_rate): read_dataset(
+            '../data/' + model + '/' + missing_type + '_' + str(missing_rate))
+            for missing_type in missing_type_list for missing_rate in missing_rate_list}
+        for cell, dag_learned in zip(cells, dags):
+            if cell[0] != model:
+                continue
+            _, datasize, missing_type, missing_rate, algorithm = cell
+            if algorithm is None:
+                result_list.append(cell + [0, f1(dag, dag_learned)])
+            else:
+                data_impute = read_dataset(imputed_stem(*cell))
+                result_list.append(cell + [rmse(data.head(datasize), data_impute,
+                                                data_missing[(missing_type, missing_rate)].head(datasize)),
+                                           f1(dag, dag_learned)])
+            print(result_list[-1])
+
+    pandas.DataFrame(result_list, columns=columns).to_csv(result_path, index=False)
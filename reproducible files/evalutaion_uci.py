@@ -1,9 +1,8 @@
-import os.path
-
 import pandas
 from rpy2.robjects.packages import importr
 
 from accessories import rmse, pfc
+from data_io import find_format, read_dataset
 
 base, bnlearn = importr('base'), importr('bnlearn')
 
@@ -17,14 +16,16 @@ result = pandas.DataFrame(columns=columns)
 result_list = result.values.tolist()
 
 for model in model_list:
-    data = pandas.read_csv('../data/' + model + '/Complete.csv')
+    # categorical values are compared as read by the experiments, whatever format the imputed data are stored in
+    dtype = 'category' if model in ['car', 'game', 'mushroom'] else None
+    data = read_dataset('../data/' + model + '/Complete', dtype=dtype)
     for missing_type in missing_type_list:
         for missing_rate in missing_rate_list:
-            data_missing = pandas.read_csv('../data/' + model + '/' + missing_type + '_' + str(missing_rate) + '.csv')
+            data_missing = read_dataset('../data/' + model + '/' + missing_type + '_' + str(missing_rate), dtype=dtype)
             for algorithm in algorithm_list:
-                data_path = '../imputed_data/' + model + '/' + missing_type + '_' + str(missing_rate) + '_' + algorithm + '.csv'
-                if os.path.isfile(data_path):
-                    data_impute = pandas.read_csv(data_path)
+                data_stem = '../imputed_data/' + model + '/' + missing_type + '_' + str(missing_rate) + '_' + algorithm
+                if find_format(data_stem) is not None:
+                    data_impute = read_dataset(data_stem, dtype=dtype)
                     if model in ['car', 'game', 'mushroom']:
                         result_list.append([model, missing_type, missing_rate, algorithm, pfc(data, data_impute, data_missing)])
                     else:
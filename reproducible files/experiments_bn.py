@@ -1,17 +1,14 @@
-import os
+import argparse
+from functools import lru_cache
 
 import numpy
 import pandas
-import rpy2.robjects as ro
 from sklearn.impute import KNNImputer, SimpleImputer
 
-from GAIN.gain import gain
 from accessories import rmse
+from data_io import read_dataset, write_dataset
 from softimpute import softimpute, cv_softimpute
 
-ro.r('''source('../missForest.r')''')
-missForest = ro.globalenv['missForest']
-
 model_list = ['ecoli70', 'magic-irri', 'arth150']
 datasize_list = [500, 1000, 2000, 3000]
 missing_type_list = ['MCAR', 'MAR', 'MNAR']
@@ -22,43 +19,98 @@ gain_parameters = {'batch_size': 64,
                    'alpha': 10,
                    'iterations': 10000}
 
-for model in model_list:
-    # load complete model
-    data = pandas.read_csv('../data/' + model + '/Complete.csv')
-    for missing_type in missing_type_list:
-        for missing_rate in missing_rate_list:
-            # load missing model
-            data_missing = pandas.read_csv('../data/' + model + '/' + missing_type + '_' + str(missing_rate) + '.csv')
-            for datasize in datasize_list:
-                for algorithm in algorithm_list:
-                    data_path = '../imputed_data/' + model + '/' + missing_type + '_' + str(missing_rate) + '_' + str(
-                        datasize) + '_' + algorithm + '.csv'
-                    if algorithm == 'GAIN':
-                        data_imputed = pandas.DataFrame(gain(data_missing.head(datasize).to_numpy(), gain_parameters),
-                                                        columns=data.columns)
-                    elif algorithm == 'KNN':
-                        imputer = KNNImputer()
-                        data_imputed = pandas.DataFrame(imputer.fit_transform(data_missing.head(datasize)),
-                                                        columns=list(data.columns))
-                    elif algorithm == 'Mean':
-                        imputer = SimpleImputer(missing_values=numpy.nan, strategy='mean')
-                        data_imputed = pandas.DataFrame(imputer.fit_transform(data_missing.head(datasize)),
-                                                        columns=list(data.columns))
-                    elif algorithm == 'MF':
-                        data_imputed = ro.conversion.rpy2py(
-                            missForest(ro.conversion.py2rpy(data_missing.head(datasize)), fs='None')[0]).reset_index()
-                    elif algorithm == 'MBMF':
-                        data_imputed = ro.conversion.rpy2py(
-                            missForest(ro.conversion.py2rpy(data_missing.head(datasize)), fs='mbfs')[0]).reset_index()
-                    elif algorithm == 'softImpute':
-                        cv_error, grid_lambda = cv_softimpute(data_missing.head(datasize).to_numpy(), grid_len=5)
-                        lbda = grid_lambda[numpy.argmin(cv_error)]
-                        data_imputed = pandas.DataFrame(softimpute(data_missing.head(datasize).to_numpy(), lbda)[1],
-                                                        columns=data.columns)
-                    else:
-                        raise Exception('Undefined method (' + algorithm + ').')
-                    os.makedirs(os.path.dirname(data_path), exist_ok=True)
-                    pandas.DataFrame(data_imputed, columns=list(data.columns)).to_csv(data_path, index=False)
-                    print(model, missing_type, missing_rate, datasize, algorithm)
-                    print('root mean square error:',
-                          rmse(data.head(datasize), data_imputed, data_missing.head(datasize)))
+
+@lru_cache(maxsize=None)
+def r_missforest():
+    # R and GAIN (tensorflow) are only loaded by the algorithms using them, and missForest.R is sourced once
+    import rpy2.robjects as ro
+    from rpy2.robjects import pandas2ri
+    pandas2ri.activate()
+    ro.r('''source('../missForest.r')''')
+    return ro.globalenv['missForest']
+
+
+def impute(data_missing, algorithm):
+    """
+    @param data_missing: data with missing values
+    @param algorithm: imputation algorithm in algorithm_list
+    @return: imputed data
+    """
+    if algorithm == 'GAIN':
+        from GAIN.gain import gain
+        data_imputed = pandas.DataFrame(gain(data_missing.to_numpy(), gain_parameters), columns=data_missing.columns)
+    elif algorithm == 'KNN':
+        imputer = KNNImputer()
+        data_imputed = pandas.DataFrame(imputer.fit_transform(data_missing), columns=list(data_missing.columns))
+    elif algorithm == 'Mean':
+        imputer = SimpleImputer(missing_values=numpy.nan, strategy='mean')
+        data_imputed = pandas.DataFrame(imputer.fit_transform(data_missing), columns=list(data_missing.columns))
+    elif algorithm in ['MF', 'MBMF']:
+        import rpy2.robjects as ro
+        data_imputed = ro.conversion.rpy2py(r_missforest()(ro.conversion.py2rpy(data_missing),
+                                                           fs='None' if algorithm == 'MF' else 'mbfs')[0]).reset_index()
+    elif algorithm == 'softImpute':
+        cv_error, grid_lambda = cv_softimpute(data_missing.to_numpy(), grid_len=5)
+        lbda = grid_lambda[numpy.argmin(cv_error)]
+        data_imputed = pandas.DataFrame(softimpute(data_missing.to_numpy(), lbda)[1], columns=data_missing.columns)
+    else:
+        raise Exception('Undefined method (' + algorithm + ').')
+    return pandas.DataFrame(data_imputed, columns=list(data_missing.columns))
+
+
+def tasks():
+    """
+    @return: cells of the experiment, with the parameters of the algorithm
+    """
+    return [{'experiment': 'bn', 'model': model, 'missing_type': missing_type, 'missing_rate': missing_rate,
+             'datasize': datasize, 'algorithm': algorithm, 'params': gain_parameters if algorithm == 'GAIN' else {}}
+            for model in model_list for missing_type in missing_type_list for missing_rate in missing_rate_list
+            for datasize in datasize_list for algorithm in algorithm_list]
+
+
+def output_stem(task):
+    return '../imputed_data/' + task['model'] + '/' + task['missing_type'] + '_' + str(task['missing_rate']) + '_' + \
+        str(task['datasize']) + '_' + task['algorithm']
+
+
+def load_task(task, fmt=None):
+    """
+    @param task: cell of the experiment returned by tasks
+    @param fmt: columnar format the CSV file is converted to on its first read, None to read the stored format
+    @return: data with missing values of all sizes of the cell
+    """
+    return read_dataset('../data/' + task['model'] + '/' + task['missing_type'] + '_' + str(task['missing_rate']), fmt)
+
+
+def impute_task(task, fmt=None):
+    """
+    @param task: cell of the experiment returned by tasks
+    @param fmt: columnar format the CSV file is converted to on its first read, None to read the stored format
+    @return: imputed data of the cell
+    """
+    return impute(load_task(task, fmt).head(task['datasize']), task['algorithm'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--format', help='storage format of the data sets and imputed data', default='csv',
+                        choices=['csv', 'npy', 'feather', 'parquet'], type=str)
+    args = parser.parse_args()
+
+    for model in model_list:
+        # load complete model
+        data = read_dataset('../data/' + model + '/Complete', args.format)
+        for missing_type in missing_type_list:
+            for missing_rate in missing_rate_list:
+                # load missing model, once for all sizes
+                data_missing = load_task({'model': model, 'missing_type': missing_type, 'missing_rate': missing_rate},
+                                         args.format)
+                for datasize in datasize_list:
+                    for algorithm in algorithm_list:
+                        data_imputed = impute(data_missing.head(datasize), algorithm)
+                        write_dataset(data_imputed, output_stem({'model': model, 'missing_type': missing_type,
+                                                                 'missing_rate': missing_rate, 'datasize': datasize,
+                                                                 'algorithm': algorithm}), args.format)
+                        print(model, missing_type, missing_rate, datasize, algorithm)
+                        print('root mean square error:',
+                              rmse(data.head(datasize), data_imputed, data_missing.head(datasize)))
@@ -1,18 +1,21 @@
-import os
-from pathlib import Path
+import argparse
+from functools import lru_cache
 
 import numpy
 import pandas
-import rpy2.robjects as ro
-from rpy2.robjects import pandas2ri
 from sklearn.impute import KNNImputer, SimpleImputer
 from sklearn.preprocessing import MinMaxScaler
+
+from data_io import read_dataset, write_dataset
 from softimpute import softimpute, cv_softimpute
-from GAIN.gain import gain
-from rpy2.robjects.conversion import localconverter
 
-ro.r('''source('../missForest.r')''')
-missForest = ro.globalenv['missForest']
+
+@lru_cache(maxsize=None)
+def r_missforest():
+    # R and GAIN (tensorflow) are only loaded by the algorithms using them, and missForest.R is sourced once
+    import rpy2.robjects as ro
+    ro.r('''source('../missForest.r')''')
+    return ro.globalenv['missForest']
 
 
 def find_category_mappings(df, variable):
@@ -62,66 +65,111 @@ model_list = ['iris', 'breast', 'wine', 'car', 'game', 'mushroom']
 missing_type_list = ['MCAR', 'MAR', 'MNAR']
 algorithm_list = ['Mean', 'Mode', 'KNN', 'GAIN', 'MF', 'MBMF', 'softImpute']
 missing_rate_list = [0.1, 0.3, 0.5]
-
-for model in model_list:
-    for missing_type in missing_type_list:
-        for missing_rate in missing_rate_list:
-            # load missing model
-            data_path = '../data/' + model + '/' + missing_type + '_' + str(missing_rate) + '.csv'
-            data_missing = pandas.read_csv(data_path, dtype='category') if model in ['car', 'game',
-                                                                                     'mushroom'] else pandas.read_csv(
-                data_path)
-            with localconverter(ro.default_converter + pandas2ri.converter):
-                data_missing_r = ro.conversion.py2rpy(data_missing)
-            for algorithm in algorithm_list:
-                data_path = '../imputed_data/' + str(model) + '/' + missing_type + '_' + str(
-                    missing_rate) + '_' + algorithm + '.csv'
-                if algorithm == 'GAIN':
-                    if model in ['car', 'game', 'mushroom']:
-                        continue
-                    else:
-                        data_imputed = pandas.DataFrame(gain(data_missing.to_numpy(), gain_parameters),
-                                                        columns=data_missing.columns)
-                elif algorithm == 'KNN':
-                    if model in ['car', 'game', 'mushroom']:
-                        data_imputed = imputation(data_missing, data_missing.columns.tolist())
-                    else:
-                        imputer = KNNImputer()
-                        data_imputed = pandas.DataFrame(imputer.fit_transform(data_missing),
-                                                        columns=list(data_missing.columns))
-                elif algorithm == 'Mode':
-                    if model in ['car', 'game', 'mushroom']:
-                        imputer = SimpleImputer(missing_values=numpy.nan, strategy='most_frequent')
-                        data_imputed = pandas.DataFrame(imputer.fit_transform(data_missing),
-                                                        columns=list(data_missing.columns))
-                    else:
-                        continue
-                elif algorithm == 'Mean':
-                    if model in ['car', 'game', 'mushroom']:
-                        continue
-                    else:
-                        imputer = SimpleImputer(missing_values=numpy.nan, strategy='mean')
-                        data_imputed = pandas.DataFrame(imputer.fit_transform(data_missing),
-                                                        columns=list(data_missing.columns))
-                elif algorithm == 'MF':
-                    data_imputed = missForest(data_missing_r, fs='None')[0]
-                    with localconverter(ro.default_converter + pandas2ri.converter):
-                        data_imputed = ro.conversion.rpy2py(data_imputed)
-
-                elif algorithm == 'MBMF':
-                    data_imputed = missForest(data_missing_r, fs='mbfs')[0]
-                    with localconverter(ro.default_converter + pandas2ri.converter):
-                        data_imputed = ro.conversion.rpy2py(data_imputed)
-                elif algorithm == 'SoftImpute':
-                    if model in ['car', 'game', 'mushroom']:
+categorical_list = ['car', 'game', 'mushroom']
+
+
+def applicable(model, algorithm):
+    # GAIN, mean imputation and softImpute are for continuous data, mode imputation for categorical data
+    if model in categorical_list:
+        return algorithm not in ['GAIN', 'Mean', 'softImpute']
+    return algorithm != 'Mode'
+
+
+def load(model, missing_type, missing_rate, fmt=None):
+    # the columns of the categorical data sets keep the category dtype in the columnar formats
+    return read_dataset('../data/' + model + '/' + missing_type + '_' + str(missing_rate), fmt,
+                        'category' if model in categorical_list else None)
+
+
+def impute(data_missing, model, algorithm):
+    """
+    @param data_missing: data with missing values
+    @param model: name of the data set
+    @param algorithm: imputation algorithm in algorithm_list, which is applicable to the data set
+    @return: imputed data
+    """
+    if algorithm == 'GAIN':
+        from GAIN.gain import gain
+        data_imputed = pandas.DataFrame(gain(data_missing.to_numpy(), gain_parameters), columns=data_missing.columns)
+    elif algorithm == 'KNN':
+        if model in categorical_list:
+            data_imputed = imputation(data_missing, data_missing.columns.tolist())
+        else:
+            imputer = KNNImputer()
+            data_imputed = pandas.DataFrame(imputer.fit_transform(data_missing), columns=list(data_missing.columns))
+    elif algorithm == 'Mode':
+        imputer = SimpleImputer(missing_values=numpy.nan, strategy='most_frequent')
+        data_imputed = pandas.DataFrame(imputer.fit_transform(data_missing), columns=list(data_missing.columns))
+    elif algorithm == 'Mean':
+        imputer = SimpleImputer(missing_values=numpy.nan, strategy='mean')
+        data_imputed = pandas.DataFrame(imputer.fit_transform(data_missing), columns=list(data_missing.columns))
+    elif algorithm in ['MF', 'MBMF']:
+        import rpy2.robjects as ro
+        from rpy2.robjects import pandas2ri
+        from rpy2.robjects.conversion import localconverter
+        with localconverter(ro.default_converter + pandas2ri.converter):
+            data_missing_r = ro.conversion.py2rpy(data_missing)
+        data_imputed = r_missforest()(data_missing_r, fs='None' if algorithm == 'MF' else 'mbfs')[0]
+        with localconverter(ro.default_converter + pandas2ri.converter):
+            data_imputed = ro.conversion.rpy2py(data_imputed)
+    elif algorithm == 'softImpute':
+        cv_error, grid_lambda = cv_softimpute(data_missing.to_numpy(), grid_len=5)
+        lbda = grid_lambda[numpy.argmin(cv_error)]
+        data_imputed = pandas.DataFrame(softimpute(data_missing.to_numpy(), lbda)[1], columns=data_missing.columns)
+    else:
+        raise Exception('Undefined method ' + algorithm + '.')
+    return data_imputed
+
+
+def tasks():
+    """
+    @return: cells of the experiment, with the parameters of the algorithm
+    """
+    return [{'experiment': 'uci', 'model': model, 'missing_type': missing_type, 'missing_rate': missing_rate,
+             'algorithm': algorithm, 'params': gain_parameters if algorithm == 'GAIN' else {}}
+            for model in model_list for missing_type in missing_type_list for missing_rate in missing_rate_list
+            for algorithm in algorithm_list if applicable(model, algorithm)]
+
+
+def output_stem(task):
+    return '../imputed_data/' + str(task['model']) + '/' + task['missing_type'] + '_' + str(
+        task['missing_rate']) + '_' + task['algorithm']
+
+
+def load_task(task, fmt=None):
+    """
+    @param task: cell of the experiment returned by tasks
+    @param fmt: columnar format the CSV file is converted to on its first read, None to read the stored format
+    @return: data with missing values of the cell
+    """
+    return load(task['model'], task['missing_type'], task['missing_rate'], fmt)
+
+
+def impute_task(task, fmt=None):
+    """
+    @param task: cell of the experiment returned by tasks
+    @param fmt: columnar format the CSV file is converted to on its first read, None to read the stored format
+    @return: imputed data of the cell
+    """
+    return impute(load_task(task, fmt), task['model'], task['algorithm'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--format', help='storage format of the data sets and imputed data', default='csv',
+                        choices=['csv', 'npy', 'feather', 'parquet'], type=str)
+    args = parser.parse_args()
+
+    for model in model_list:
+        for missing_type in missing_type_list:
+            for missing_rate in missing_rate_list:
+                # load missing model
+                data_missing = load(model, missing_type, missing_rate, args.format)
+                for algorithm in algorithm_list:
+                    if not applicable(model, algorithm):
                         continue
-                    else:
-                        cv_error, grid_lambda = cv_softimpute(data_missing.to_numpy(), grid_len=5)
-                        lbda = grid_lambda[numpy.argmin(cv_error)]
-                        data_imputed = pandas.DataFrame(softimpute(data_missing.to_numpy(), lbda)[1],
-                                                        columns=data_missing.columns)
-                else:
-                    raise Exception('Undefined method ' + algorithm + '.')
-                Path(os.path.dirname(data_path)).mkdir(parents=True, exist_ok=True)
-                data_imputed.to_csv(data_path, index=False)
-                print(model, missing_type, missing_rate, algorithm)
+                    data_imputed = impute(data_missing, model, algorithm)
+                    write_dataset(data_imputed, output_stem({'model': model, 'missing_type': missing_type,
+                                                             'missing_rate': missing_rate, 'algorithm': algorithm}),
+                                  args.format)
+                    print(model, missing_type, missing_rate, algorithm)
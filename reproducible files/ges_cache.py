@@ -0,0 +1,59 @@
+"""
+Disk cache of the DAGs learned by GES, keyed by a hash of the content of the stored input data set and the number of
+rows used, so that only the DAGs of new or modified data sets are learned again. The missing DAGs are learned in
+parallel.
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from bnsl import ges
+
+from data_io import content_hash, dataset_path, find_format, read_dataset
+
+
+def learn(stem, datasize=None):
+    """
+    @param stem: complete data set, as path without extension
+    @param datasize: number of first rows used, all if None
+    @return: DAG learned by GES
+    """
+    data = read_dataset(stem)
+    return ges(data if datasize is None else data.head(datasize))
+
+
+def learn_all(inputs, n_jobs=1, cache_dir='../ges_cache'):
+    """
+    @param inputs: list of (data set as path without extension, number of first rows used or None for all)
+    @param n_jobs: number of processes learning the DAGs which are not cached, -1 for all cores
+    @param cache_dir: directory of the cached DAGs
+    @return: list of the DAGs learned by GES from inputs
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    hashes = {}
+    for stem, _ in inputs:
+        if stem not in hashes:
+            hashes[stem] = content_hash(dataset_path(stem, find_format(stem)))
+    keys = [hashes[stem] + ('' if datasize is None else '_' + str(datasize)) for stem, datasize in inputs]
+    dags = {}
+    todo = {}
+    for key, (stem, datasize) in zip(keys, inputs):
+        if key in dags or key in todo:
+            continue
+        cache_path = os.path.join(cache_dir, key + '.json')
+        if os.path.isfile(cache_path):
+            with open(cache_path) as f:
+                dags[key] = json.load(f)
+        else:
+            todo[key] = (stem, datasize)
+    print(len(set(keys)) - len(todo), 'of', len(set(keys)), 'DAGs found in', cache_dir)
+    with ProcessPoolExecutor(n_jobs if n_jobs > 0 else None) as executor:
+        futures = {key: executor.submit(learn, *todo[key]) for key in todo}
+        for key in futures:
+            dags[key] = futures[key].result()
+            # written to a temporary file first, so that an interrupted run does not leave a corrupt DAG
+            cache_path = os.path.join(cache_dir, key + '.json')
+            with open(cache_path + '.tmp', 'w') as f:
+                json.dump(dags[key], f)
+            os.replace(cache_path + '.tmp', cache_path)
+    return [dags[key] for key in keys]
@@ -0,0 +1,184 @@
+"""
+Runs the cells of experiments_bn.py and experiments_uci.py in parallel processes, one process per cell, which is
+killed after a timeout. A cell is skipped if its imputed data exist with the hash of the same configuration, so an
+interrupted run resumes where it stopped. The input data sets are loaded once, before the cell processes are forked,
+and the imputed data are stored in a format of data_io.py. The cheap algorithms are scheduled first and at most
+heavy_jobs GAIN cells run at a time, so GAIN does not hold up the other cells. The status, wall time and peak resident
+memory of every run cell, above the memory inherited from the runner, are appended to a manifest as JSON lines.
+
+$ python3 runner.py --experiments bn uci --n_jobs 8 --timeout 7200 --format npy
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import resource
+import time
+from multiprocessing.connection import wait
+
+import experiments_bn
+import experiments_uci
+from data_io import dataset_path, write_dataset
+
+experiments = {'bn': experiments_bn, 'uci': experiments_uci}
+# algorithms in increasing order of their running time
+cost_order = ['Mean', 'Mode', 'KNN', 'softImpute', 'MF', 'MBMF', 'GAIN']
+heavy_list = ['GAIN']
+
+
+def config_hash(task):
+    return hashlib.blake2b(json.dumps(task, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+def completed(task, path):
+    """
+    @return: whether the imputed data of task exist and were produced by the same configuration
+    """
+    if not os.path.exists(path) or not os.path.isfile(path + '.hash'):
+        return False
+    with open(path + '.hash') as f:
+        return f.read().strip() == config_hash(task)
+
+
+def peak_rss(pid):
+    """
+    @return: peak resident memory in MB of a running process, None if unknown (the process ended or not on Linux)
+    """
+    try:
+        with open('/proc/' + str(pid) + '/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def receive(receiver):
+    """
+    @return: next message of a cell, None if there is none (yet) or the cell ended without sending it
+    """
+    try:
+        return receiver.recv() if receiver.poll() else None
+    except EOFError:
+        return None
+
+
+def work(task, stem, fmt, connection):
+    start = time.perf_counter()
+    # the forked cell starts with the memory of the runner, including the preloaded data sets, which is not its own.
+    # ru_maxrss is in kilobytes on Linux
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    connection.send(baseline)
+    path = dataset_path(stem, fmt)
+    try:
+        data_imputed = experiments[task['experiment']].impute_task(task, fmt)
+        # the output is moved in place once written and then marked by its hash, a killed cell is always rerun
+        if os.path.isfile(path + '.hash'):
+            os.remove(path + '.hash')
+        write_dataset(data_imputed, stem, fmt)
+        with open(path + '.hash', 'w') as f:
+            f.write(config_hash(task))
+        status = 'done'
+    except Exception as e:
+        status = 'failed: ' + repr(e)
+    connection.send({'status': status, 'wall_time': time.perf_counter() - start,
+                     'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - baseline})
+    connection.close()
+
+
+def run(tasks, n_jobs=1, heavy_jobs=1, timeout=None, manifest='../imputed_data/manifest.jsonl', force=False,
+        fmt='csv'):
+    """
+    @param tasks: cells of the experiments returned by their tasks function
+    @param n_jobs: maximum number of cells run at a time
+    @param heavy_jobs: maximum number of GAIN cells run at a time
+    @param timeout: time in seconds after which a cell is killed, unlimited if None
+    @param manifest: JSON lines file the result of every run cell is appended to
+    @param force: whether to run the cells whose imputed data exist
+    @param fmt: storage format of the data sets and imputed data in data_io.formats
+    @return: results of the run cells
+    """
+    stems = [experiments[task['experiment']].output_stem(task) for task in tasks]
+    pending = [(task, stem) for task, stem in zip(tasks, stems)
+               if force or not completed(task, dataset_path(stem, fmt))]
+    print(len(tasks) - len(pending), 'of', len(tasks), 'cells are up to date')
+    # the forked cell processes share the data sets loaded here instead of reading them again
+    for task, _ in pending:
+        try:
+            experiments[task['experiment']].load_task(task, fmt)
+        except Exception:
+            # reported by the cell
+            pass
+    pending.sort(key=lambda x: cost_order.index(x[0]['algorithm']))
+    if os.path.dirname(manifest):
+        os.makedirs(os.path.dirname(manifest), exist_ok=True)
+    running = {}
+    results = []
+    with open(manifest, 'a') as log:
+        while pending or running:
+            n_heavy = sum(task['algorithm'] in heavy_list for task, _, _, _ in running.values())
+            for task, stem in list(pending):
+                if len(running) >= n_jobs:
+                    break
+                if task['algorithm'] in heavy_list and n_heavy >= heavy_jobs:
+                    continue
+                receiver, sender = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(target=work, args=(task, stem, fmt, sender), daemon=True)
+                process.start()
+                sender.close()
+                running[process] = (task, stem, receiver, time.perf_counter())
+                pending.remove((task, stem))
+                n_heavy += task['algorithm'] in heavy_list
+            # wake up when a cell finishes or the earliest timeout expires
+            deadline = None if timeout is None else min(start + timeout for _, _, _, start in running.values())
+            wait([process.sentinel for process in running],
+                 None if deadline is None else max(0, deadline - time.perf_counter()))
+            for process in list(running):
+                task, stem, receiver, start = running[process]
+                if process.is_alive() and (timeout is None or time.perf_counter() - start < timeout):
+                    continue
+                # the first message of a cell is its memory at fork time
+                baseline = receive(receiver)
+                if process.is_alive():
+                    peak = peak_rss(process.pid)
+                    result = {'status': 'timeout', 'wall_time': time.perf_counter() - start,
+                              'peak_rss_mb': None if peak is None or baseline is None else peak - baseline}
+                    process.kill()
+                else:
+                    result = receive(receiver)
+                if result is None:
+                    result = {'status': 'crashed (exit code ' + str(process.exitcode) + ')',
+                              'wall_time': time.perf_counter() - start, 'peak_rss_mb': None}
+                process.join()
+                receiver.close()
+                del running[process]
+                result = dict(task, output=dataset_path(stem, fmt), hash=config_hash(task), **result)
+                log.write(json.dumps(result) + '\n')
+                log.flush()
+                results.append(result)
+                print(task['experiment'], task['model'], task['missing_type'], task['missing_rate'],
+                      task.get('datasize', ''), task['algorithm'], result['status'],
+                      '%.1f s' % result['wall_time'])
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--experiments', choices=['bn', 'uci'], nargs='+', default=['bn', 'uci'], type=str)
+    parser.add_argument('--models', help='only run these models (data sets)', nargs='+', default=None, type=str)
+    parser.add_argument('--algorithms', help='only run these algorithms', nargs='+', default=None, type=str)
+    parser.add_argument('--n_jobs', help='number of cells run at a time', default=os.cpu_count(), type=int)
+    parser.add_argument('--heavy_jobs', help='number of GAIN cells run at a time', default=1, type=int)
+    parser.add_argument('--timeout', help='seconds after which a cell is killed', default=None, type=float)
+    parser.add_argument('--manifest', default='../imputed_data/manifest.jsonl', type=str)
+    parser.add_argument('--force', help='rerun the cells which are up to date', action='store_true')
+    parser.add_argument('--format', help='storage format of the data sets and imputed data', default='csv',
+                        choices=['csv', 'npy', 'feather', 'parquet'], type=str)
+    args = parser.parse_args()
+
+    tasks = [task for experiment in args.experiments for task in experiments[experiment].tasks()
+             if (args.models is None or task['model'] in args.models) and (
+                     args.algorithms is None or task['algorithm'] in args.algorithms)]
+    run(tasks, args.n_jobs, args.heavy_jobs, args.timeout, args.manifest, args.force, args.format)
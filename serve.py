@@ -0,0 +1,66 @@
+"""
+Imputation service of a saved MBFSImputer. Every request is a JSON record, or a list of records, whose missing values
+are null or absent, and the response holds the imputed record(s).
+
+$ python3 serve.py --imputer imputer.pkl                # one request per line on stdin, responses on stdout
+$ python3 serve.py --imputer imputer.pkl --port 8000    # HTTP POST requests on localhost:8000
+"""
+import argparse
+import json
+import sys
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from imputer import MBFSImputer
+
+
+def respond(imputer, request):
+    """
+    @param imputer: fitted MBFSImputer
+    @param request: JSON record or list of records
+    @return: JSON of the imputed record(s), or of the error message
+    """
+    try:
+        response = imputer.impute(json.loads(request))
+    except Exception as e:
+        response = {'error': str(e)}
+    # numpy scalars of the imputed values and categories
+    return json.dumps(response, default=lambda x: x.item())
+
+
+def serve_http(imputer, host, port):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = self.headers['Content-Length']
+            if length is None:
+                status, body = 411, json.dumps({'error': 'Content-Length required'})
+            elif not length.strip().isdigit():
+                status, body = 400, json.dumps({'error': 'invalid Content-Length: ' + length})
+            else:
+                status, body = 200, respond(imputer, self.rfile.read(int(length)))
+            body = body.encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    HTTPServer((host, port), Handler).serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--imputer', help='file of the MBFSImputer saved by MBFSImputer.save', required=True, type=str)
+    parser.add_argument('--host', default='localhost', type=str)
+    parser.add_argument('--port', help='serve HTTP requests on this port instead of stdin', default=None, type=int)
+    args = parser.parse_args()
+
+    imputer = MBFSImputer.load(args.imputer)
+    if args.port is not None:
+        serve_http(imputer, args.host, args.port)
+    else:
+        for line in sys.stdin:
+            if line.strip():
+                print(respond(imputer, line), flush=True)